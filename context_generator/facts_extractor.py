@@ -5,25 +5,155 @@ This script extracts key user persona facts using semantic vector search.
 Extracts communication style, interests, personality traits, values, and concerns.
 """
 
-import os
+import hashlib
 import logging
-from typing import List, Set
-from dotenv import load_dotenv
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional
 
 from utils import database
-from utils.llm import DeepSeekClient
+from utils.bootstrap import ensure_loaded
+from utils.llm import get_deepseek_api_key, get_deepseek_client
 from utils import vector_search
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Setup logging (only if not already configured)
-if not logging.getLogger().handlers:
-    logging.basicConfig(level=logging.INFO)
+# Load environment variables and default logging configuration (once per process)
+ensure_loaded()
 logger = logging.getLogger(__name__)
 
 
-def extract_user_facts(user_id: str, model_tag: str = 'e5') -> str:
+# Minimum prompt content; below this the reasoning model is not called at all
+MIN_PROMPT_MESSAGES = 3
+MIN_PROMPT_CHARS = 200
+
+# Maximum number of retrieved messages sent to the reasoner (the most relevant ones are kept);
+# reasoner latency and cost grow with input tokens
+FACTS_MAX_PROMPT_MESSAGES = int(os.getenv("FACTS_MAX_PROMPT_MESSAGES", "500"))
+
+# Focus areas used as semantic queries for retrieving persona-relevant messages
+FACTS_FOCUS_AREAS = [
+    "communication style and patterns",
+    "interests and preferences",
+    "personality traits and characteristics",
+    "values and concerns",
+    "notable characteristics and traits",
+    "behavioural patterns and habits"
+]
+
+# Instruction preamble for persona facts extraction, sent as the system message.
+# It contains no per-call data besides the preferred language (a small fixed set),
+# so the provider's prompt prefix cache can be reused across requests.
+FACTS_PROMPT_PREAMBLE = """You are an intelligent user-profiling assistant.
+Analyze the user messages provided in the next message and extract their stable persona characteristics and factual context.
+
+CRITICAL LANGUAGE REQUIREMENT:
+- The user's preferred language is {preferred_language}
+- You MUST write your entire response ONLY in {preferred_language}
+- IGNORE the language of the user messages
+- If preferred language is English, respond in English
+- If preferred language is Chinese, respond in Chinese
+- If preferred language is Malay (Bahasa Melayu), respond in Malay
+- Do NOT switch languages under any circumstances
+
+Focus on these categories:
+- Communication style and patterns
+- Interests and preferences
+- Personality traits
+- Values and concerns
+- Notable characteristics
+- Behavioural patterns
+
+Please output a **structured**, **detailed** summary of the user's facts in clearly-labelled bullet points by category.
+Important constraints:
+• Output MUST be in {preferred_language} (the user's preferred language)
+• Only include items you can reasonably infer.
+• Do **not** include additional justification or long explanations.
+
+Output only the summary in {preferred_language}.
+"""
+
+# Version of the facts prompt (derived from the preamble text). It is part of the cache keys
+# below, so stored facts generated with older instructions are never reused after an edit.
+FACTS_PROMPT_VERSION = hashlib.sha256(FACTS_PROMPT_PREAMBLE.encode("utf-8")).hexdigest()[:12]
+
+
+def _count_texts(texts: Iterable[str], totals: Dict[str, int]) -> Iterator[str]:
+    """
+    Pass message texts through unchanged while counting them and their characters.
+    
+    Args:
+        texts: Message texts (may be a lazy stream)
+        totals: Dict with "messages" and "chars" counters, updated in place
+    
+    Yields:
+        The same message texts, in order
+    """
+    for text in texts:
+        totals["messages"] += 1
+        totals["chars"] += len(text)
+        yield text
+
+
+def _facts_fingerprint(ref_ids: List[str], preferred_language: str) -> str:
+    """
+    Compute a stable fingerprint of the facts inputs
+    (prompt version + output language + retrieved message ids).
+    
+    Args:
+        ref_ids: Message ref_ids selected by the semantic search
+        preferred_language: Output language used in the prompt
+    
+    Returns:
+        SHA-256 hex digest
+    """
+    hasher = hashlib.sha256(f"{FACTS_PROMPT_VERSION}|{preferred_language}".encode("utf-8"))
+    for ref_id in sorted(ref_ids):
+        hasher.update(b"\0")
+        hasher.update(ref_id.encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def _facts_source_stamp(embeddings_version: Optional[str], model_tag: str, preferred_language: str) -> Optional[str]:
+    """
+    Build a stamp of everything the facts depend on that can be read without a vector search.
+    
+    The relevant messages can only change when message embeddings are stored, re-embedded
+    or deleted, so the embeddings version (newest updated_at plus row count) together with
+    the prompt version, message cap and output language identifies the inputs.
+    
+    Args:
+        embeddings_version: Version of the user's message embeddings
+                            (see database.get_embeddings_version)
+        model_tag: Embedding model tag
+        preferred_language: Output language used in the prompt
+    
+    Returns:
+        Stamp string, or None if the user has no message embeddings (or the lookup failed)
+    """
+    if not embeddings_version:
+        return None
+    return (f"{FACTS_PROMPT_VERSION}|{FACTS_MAX_PROMPT_MESSAGES}|"
+            f"{preferred_language}|{model_tag}|{embeddings_version}")
+
+
+def _stored_facts_if(bundle: Optional[Dict], column: str, value: Optional[str]) -> Optional[str]:
+    """
+    Return the stored facts if the bundle's column matches value.
+    
+    Args:
+        bundle: Stored users_context_bundle row (or None)
+        column: Column holding the stamp/fingerprint of the stored facts
+        value: Stamp/fingerprint of the current inputs
+    
+    Returns:
+        Stored facts, or None if missing or outdated
+    """
+    if bundle and value and bundle.get("facts") and bundle.get(column) == value:
+        return bundle["facts"]
+    return None
+
+
+def extract_user_facts(user_id: str, model_tag: str = 'e5', force: bool = False) -> str:
     """
     Extract user persona facts and characteristics using semantic vector search.
     
@@ -36,158 +166,96 @@ def extract_user_facts(user_id: str, model_tag: str = 'e5') -> str:
     Args:
         user_id: UUID of the user
         model_tag: Embedding model tag ('miniLM' or 'e5'), default 'e5'
+        force: Regenerate even if there are no new messages since the last run
     
     Returns:
-        Generated persona facts summary string
+        Generated (or reused) persona facts summary string
     
     Raises:
-        ValueError: If API key is missing
+        ValueError: If API key is missing or there is too little message content
         Exception: If vector search or LLM API call fails
     """
-    # Load API key
-    api_key = os.getenv("DEEPSEEK_API_KEY")
-    if not api_key:
-        raise ValueError("DEEPSEEK_API_KEY environment variable is required")
+    # Fail fast if the API key is missing (cached per process)
+    get_deepseek_api_key()
     
     logger.info(f"Extracting persona facts for user {user_id} using semantic search (model: {model_tag})")
     
-    # Define focus areas for semantic queries
-    focus_areas = [
-        "communication style and patterns",
-        "interests and preferences",
-        "personality traits and characteristics",
-        "values and concerns",
-        "notable characteristics and traits",
-        "behavioural patterns and habits"
-    ]
-    
-    # Perform semantic queries for each focus area
-    all_ref_ids: Set[str] = set()
-    similarity_threshold = 0.7
-    
-    logger.info(f"Performing semantic queries for {len(focus_areas)} focus areas")
-    for i, focus_area in enumerate(focus_areas, 1):
-        try:
-            logger.debug(f"Querying focus area {i}/{len(focus_areas)}: '{focus_area}'")
-            results = vector_search.query_embeddings_by_semantic_prompt(
-                user_id=user_id,
-                query_text=focus_area,
-                model_tag=model_tag,
-                similarity_threshold=similarity_threshold,
-                kind='message'
-            )
-            
-            # Collect unique ref_ids
-            for result in results:
-                ref_id = result.get('ref_id')
-                if ref_id:
-                    all_ref_ids.add(str(ref_id))
-            
-            logger.debug(f"Found {len(results)} results for '{focus_area}' (unique ref_ids so far: {len(all_ref_ids)})")
-            
-        except Exception as e:
-            logger.warning(f"Failed to query focus area '{focus_area}': {e}")
-            # Continue with other focus areas even if one fails
-            continue
-    
-    # If no results found, try lowering threshold
-    if not all_ref_ids:
-        logger.warning(f"No results found with threshold {similarity_threshold}, trying lower threshold 0.6")
-        similarity_threshold = 0.6
-        for focus_area in focus_areas:
-            try:
-                results = vector_search.query_embeddings_by_semantic_prompt(
-                    user_id=user_id,
-                    query_text=focus_area,
-                    model_tag=model_tag,
-                    similarity_threshold=similarity_threshold,
-                    kind='message'
-                )
-                for result in results:
-                    ref_id = result.get('ref_id')
-                    if ref_id:
-                        all_ref_ids.add(str(ref_id))
-            except Exception as e:
-                logger.warning(f"Failed to query focus area '{focus_area}' with lower threshold: {e}")
-                continue
-    
-    if not all_ref_ids:
-        raise ValueError(f"No relevant messages found for user {user_id} with semantic search")
-    
-    logger.info(f"Retrieved {len(all_ref_ids)} unique message references")
-    
-    # Retrieve message texts from database
-    logger.info("Retrieving message texts from database")
-    message_texts = vector_search.retrieve_message_texts(list(all_ref_ids))
-    
-    if not message_texts:
-        raise ValueError(f"Failed to retrieve message texts for user {user_id}")
+    # The preferred language (from the database, instead of detecting from messages), the
+    # message embeddings version and the stored facts are independent lookups: overlap them
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        language_future = executor.submit(database.get_user_language_name, user_id)
+        embeddings_version_future = executor.submit(
+            database.get_embeddings_version, user_id, model_tag, "message"
+        )
+        bundle_future = None if force else executor.submit(
+            database.get_users_context_bundle, user_id, "facts, facts_fingerprint, facts_source_stamp"
+        )
+        preferred_language = language_future.result()
+        source_stamp = _facts_source_stamp(embeddings_version_future.result(), model_tag, preferred_language)
+        bundle = bundle_future.result() if bundle_future else None
+    
+    # Cheapest short-circuit: no message embeddings added, changed or removed (and same
+    # language) since the stored facts were built, so skip the vector search, text
+    # retrieval and LLM call
+    if not force:
+        stored_facts = _stored_facts_if(bundle, "facts_source_stamp", source_stamp)
+        if stored_facts:
+            logger.info(f"No new messages since last run for user {user_id}, reusing stored facts")
+            return stored_facts
     
-    logger.info(f"Retrieved {len(message_texts)} message texts")
+    # Find relevant messages with one batched semantic query over the focus areas
+    # (too few strong matches would fail the content check below, so include weaker ones then;
+    # large histories are capped to the best matches to bound the reasoner prompt)
+    ref_ids = vector_search.retrieve_relevant_ref_ids(
+        user_id,
+        FACTS_FOCUS_AREAS,
+        model_tag=model_tag,
+        min_primary_results=MIN_PROMPT_MESSAGES,
+        max_results=FACTS_MAX_PROMPT_MESSAGES
+    )
+    
+    # Skip text retrieval and the LLM call if the facts were already generated from the same messages
+    fingerprint = _facts_fingerprint(ref_ids, preferred_language)
+    stored_facts = _stored_facts_if(bundle, "facts_fingerprint", fingerprint)
+    if stored_facts:
+        logger.info(f"Relevant messages unchanged since last run for user {user_id}, reusing stored facts")
+        return stored_facts
+    
+    # Stream deduplicated message texts straight into the prompt (no ref_id -> text dict in memory),
+    # counting them on the way for the minimum-content check
+    totals = {"messages": 0, "chars": 0}
+    message_texts = _count_texts(
+        vector_search.dedupe_message_texts(vector_search.iter_message_texts(ref_ids)), totals
+    )
+    first_text = next(message_texts, None)
+    if first_text is None:
+        raise ValueError(f"Failed to retrieve message texts for user {user_id}")
     
     # Format messages for LLM prompt
-    messages_text = "\n".join([f"- {text}" for text in message_texts.values()])
-    
-    # Fetch user's preferred language from database (instead of detecting from messages)
-    language_code = database.get_user_language(user_id)
-    
-    # Map language code/name to human-readable name for LLM prompt
-    # Support both codes (en, zh, ms) and full names (English, Chinese, Malay)
-    language_map = {
-        "en": "English",
-        "zh": "Chinese",
-        "ms": "Malay",
-        "zh-CN": "Chinese",
-        "zh-TW": "Chinese",
-        "ms-MY": "Malay",
-        # Also support full language names directly
-        "English": "English",
-        "Chinese": "Chinese",
-        "Malay": "Malay"
-    }
-    preferred_language = language_map.get(language_code, "English")  # Default to English if unknown code
-    
-    # Create prompt for persona facts extraction with STRONG language enforcement
-    prompt = f"""You are an intelligent user-profiling assistant.  
-            Analyze the following user messages and extract their stable persona characteristics and factual context.
-
-            CRITICAL LANGUAGE REQUIREMENT:
-            - The user's preferred language is {preferred_language}
-            - You MUST write your entire response ONLY in {preferred_language}
-            - IGNORE the language of the user messages below
-            - If preferred language is English, respond in English
-            - If preferred language is Chinese, respond in Chinese
-            - If preferred language is Malay (Bahasa Melayu), respond in Malay
-            - Do NOT switch languages under any circumstances
-
-            Focus on these categories:  
-            - Communication style and patterns  
-            - Interests and preferences  
-            - Personality traits  
-            - Values and concerns  
-            - Notable characteristics  
-            - Behavioural patterns  
-
-            User Messages:  
-            {messages_text}
-
-            Please output a **structured**, **detailed** summary of the user's facts in clearly-labelled bullet points by category.  
-            Important constraints:  
-            • Output MUST be in {preferred_language} (the user's preferred language)
-            • Only include items you can reasonably infer.  
-            • Do **not** include additional justification or long explanations.  
-
-            Output only the summary in {preferred_language}.
-            """
-
-    # Initialize LLM client
-    logger.info("Initializing DeepSeek client (chat model)")
-    client = DeepSeekClient(api_key=api_key, model="deepseek-reasoner", timeout=180.0)
+    # Single join over the texts (no per-message f-string or intermediate list): "- a\n- b\n- c"
+    messages_text = "- " + "\n- ".join(chain((first_text,), message_texts))
+    logger.info(f"Built facts prompt from {len(ref_ids)} message references ({len(messages_text)} chars)")
+    
+    # Skip the LLM call when there is too little content to extract facts from
+    if totals["messages"] < MIN_PROMPT_MESSAGES or totals["chars"] < MIN_PROMPT_CHARS:
+        raise ValueError(f"Insufficient message content for user {user_id} "
+                         f"({totals['messages']} messages, {totals['chars']} chars)")
+    
+    # Build prompt: stable instruction preamble (system) + dynamic user messages (user)
+    # Keeping the preamble as an identical prefix lets DeepSeek's context caching kick in
+    system_prompt = FACTS_PROMPT_PREAMBLE.format(preferred_language=preferred_language)
+    user_prompt = f"User Messages:\n{messages_text}"
+
+    # Reuse the cached LLM client
+    client = get_deepseek_client("deepseek-reasoner", 180.0)
     
     # Generate persona facts using LLM
     logger.info("Generating persona facts with LLM")
     try:
-        messages_for_llm = [{"role": "user", "content": prompt}]
+        messages_for_llm = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
         facts_summary = client.chat(messages_for_llm)
         
         if not facts_summary:
@@ -201,7 +269,12 @@ def extract_user_facts(user_id: str, model_tag: str = 'e5') -> str:
     
     # Save facts to database
     logger.info("Saving persona facts to database")
-    success = database.write_users_context_bundle(user_id, facts=facts_summary)
+    success = database.write_users_context_bundle(
+        user_id,
+        facts=facts_summary,
+        facts_fingerprint=fingerprint,
+        facts_source_stamp=source_stamp
+    )
     
     if not success:
         logger.warning(f"Failed to save persona facts to database for user {user_id}")
@@ -6,103 +6,98 @@ Loads user messages from the database, filters, and normalizes them for LLM proc
 """
 
 import logging
+import os
 import re
 import uuid
-from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from utils import database
-from utils.embeddings import generate_embedding
+from utils.bootstrap import ensure_loaded
+from utils.embeddings import generate_embeddings_batch
 
-# Setup logging (only if not already configured)
-if not logging.getLogger().handlers:
-    logging.basicConfig(level=logging.INFO)
+# Load environment variables and default logging configuration (once per process)
+ensure_loaded()
 logger = logging.getLogger(__name__)
 
+# Number of chunks encoded per model forward pass when embedding a conversation
+EMBEDDING_BATCH_SIZE = 64
+
+# Maximum number of concurrent bulk embedding uploads made by embed_conversation_messages
+EMBEDDING_STORE_MAX_WORKERS = int(os.getenv("EMBEDDING_STORE_MAX_WORKERS", "4"))
+
+
+# Chinese, Hiragana, Katakana and Korean ranges (matched by the C regex engine, stops at first hit)
+_CJK_RE = re.compile('[\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff\uac00-\ud7a3]')
+
+# Sentence endings: . ! ? followed by space, or end of string
+_SENTENCE_END_RE = re.compile(r'[.!?]+\s+|$')
+
 
 def _has_cjk_characters(text: str) -> bool:
     """Check if text contains Chinese, Japanese, or Korean characters."""
-    for char in text:
-        if '\u4e00' <= char <= '\u9fff':  # Chinese
-            return True
-        if '\u3040' <= char <= '\u309f':  # Hiragana
-            return True
-        if '\u30a0' <= char <= '\u30ff':  # Katakana
-            return True
-        if '\uac00' <= char <= '\ud7a3':  # Korean
-            return True
-    return False
+    # str.isascii() is O(1) in CPython, so plain ASCII messages skip the regex scan
+    return not text.isascii() and _CJK_RE.search(text) is not None
 
 
-def _filter_messages(messages: List[str], min_words: int = 4) -> List[str]:
+def _prepare_message(text: str, min_words: int = 4) -> Optional[str]:
     """
-    Filter messages to keep only those with at least min_words words.
-    For Chinese/CJK text, counts characters instead of words.
+    Normalize a message and apply the minimum-length filter in a single pass.
     
-    Args:
-        messages: List of message texts
-        min_words: Minimum number of words required (default: 4)
-    
-    Returns:
-        Filtered list of messages
-    """
-    filtered = []
-    for msg in messages:
-        # For Chinese/CJK text, count characters instead of words
-        if _has_cjk_characters(msg):
-            # Count non-whitespace characters for CJK languages
-            char_count = len([c for c in msg if not c.isspace()])
-            if char_count >= min_words:
-                filtered.append(msg)
-            else:
-                logger.debug(f"Filtered out short CJK message: {msg[:50]}... (chars: {char_count})")
-        else:
-            # For languages with spaces, count words
-            word_count = len(msg.split())
-            if word_count >= min_words:
-                filtered.append(msg)
-            else:
-                logger.debug(f"Filtered out short message: {msg[:50]}... (words: {word_count})")
-    return filtered
-
-
-def _normalize_message(text: str) -> str:
-    """
-    Normalize a message: lowercase (for non-CJK), strip whitespace, remove extra spaces.
-    For CJK languages, skip lowercasing as they don't have case.
+    Normalization strips whitespace, collapses repeated spaces and lowercases
+    non-CJK text (CJK languages have no case). Messages need at least min_words
+    words; for Chinese/CJK text, non-whitespace characters are counted instead.
     
     Args:
-        text: Message text to normalize
+        text: Message text
+        min_words: Minimum number of words required (default: 4)
     
     Returns:
-        Normalized message text
+        Normalized message text, or None if the message is too short
     """
-    # Strip whitespace and remove extra spaces
-    normalized = ' '.join(text.strip().split())
-    
-    # Only lowercase if text doesn't contain CJK characters
-    if not _has_cjk_characters(normalized):
-        normalized = normalized.lower()
-    
-    return normalized
+    # Split once; the word list serves both the length check and the normalized join
+    words = text.split()
+    
+    # For Chinese/CJK text, count characters instead of words
+    if _has_cjk_characters(text):
+        # Strip whitespace and remove extra spaces (only single ' ' separators remain)
+        normalized = ' '.join(words)
+        char_count = len(normalized) - max(len(words) - 1, 0)
+        if char_count < min_words:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Filtered out short CJK message: {normalized[:50]}... (chars: {char_count})")
+            return None
+        return normalized
+    
+    # For languages with spaces, count words
+    if len(words) < min_words:
+        # Only build the preview when debug logging is on (this runs once per message)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Filtered out short message: {text[:50]}... (words: {len(words)})")
+        return None
+    return ' '.join(words).lower()
 
 
-def _extract_message_texts(conversations: List[Dict]) -> List[str]:
+def _prepare_messages(conversations: List[Dict], min_words: int = 4) -> Iterator[str]:
     """
-    Extract all message texts from the conversation structure.
+    Yield normalized, length-filtered message texts from the conversation structure.
     
     Args:
         conversations: List of conversation dictionaries from load_user_messages
+        min_words: Minimum number of words required (default: 4)
     
-    Returns:
-        List of message text strings
+    Yields:
+        Normalized message text strings
     """
-    messages = []
     for conv in conversations:
-        for msg in conv.get("messages", []):
-            text = msg.get("text", "")
-            if text:
-                messages.append(text)
-    return messages
+        for msg in conv.get("messages", ()):
+            text = msg.get("text")
+            if not text:
+                continue
+            normalized = _prepare_message(text, min_words=min_words)
+            if normalized is not None:
+                yield normalized
 
 
 def preprocess_user_messages(user_id: str) -> List[str]:
@@ -114,10 +109,8 @@ def preprocess_user_messages(user_id: str) -> List[str]:
     
     This function:
     1. Loads all user messages from the database (single query)
-    2. Extracts message texts from conversation structure
-    3. Filters messages (discards short ones)
-    4. Normalizes messages (lowercase, strip whitespace)
-    5. Returns list of normalized message strings ready for LLM processing
+    2. Extracts, filters (discards short ones) and normalizes message texts in one pass
+    3. Returns list of normalized message strings ready for LLM processing
     
     Args:
         user_id: UUID of the user
@@ -135,106 +128,99 @@ def preprocess_user_messages(user_id: str) -> List[str]:
     if not conversations:
         raise ValueError(f"No conversations found for user {user_id}")
     
-    # Extract all message texts
-    all_messages = _extract_message_texts(conversations)
-    
-    if not all_messages:
-        raise ValueError(f"No messages found for user {user_id}")
-    
-    logger.info(f"Extracted {len(all_messages)} total messages")
+    # Extract, filter (discard very short ones) and normalize messages in one pass
+    normalized_messages = list(_prepare_messages(conversations, min_words=4))
     
-    # Filter messages (discard very short ones)
-    filtered_messages = _filter_messages(all_messages, min_words=4)
-    
-    if not filtered_messages:
+    if not normalized_messages:
         raise ValueError(f"No messages with sufficient length found for user {user_id}")
     
-    logger.info(f"After filtering: {len(filtered_messages)} messages")
-    
-    # Normalize messages
-    normalized_messages = [_normalize_message(msg) for msg in filtered_messages]
-    
     logger.info(f"Preprocessed {len(normalized_messages)} messages for LLM processing")
     
     return normalized_messages
 
 
-def _chunk_message(text: str, threshold: int = 500) -> List[Tuple[str, int]]:
+def _iter_chunks(text: str, threshold: int = 500) -> Iterator[Tuple[str, int]]:
     """
-    Split long messages into chunks if they exceed the threshold.
-    Attempts to split at sentence boundaries when possible.
+    Split long messages into chunks if they exceed the threshold, yielding each
+    chunk as it is found. Attempts to split at sentence boundaries when possible.
     
     Args:
         text: Message text to chunk
         threshold: Character threshold for chunking (default: 500)
     
-    Returns:
-        List of tuples: (chunk_text, chunk_index)
-        If no chunking needed, returns [(text, 0)]
+    Yields:
+        Tuples of (chunk_text, chunk_index)
+        If no chunking needed, yields only (text, 0)
     """
     if len(text) <= threshold:
-        return [(text, 0)]
-    
-    chunks = []
+        yield (text, 0)
+        return
     
-    # Try to split at sentence boundaries first
-    # Match sentence endings: . ! ? followed by space or end of string
-    sentence_pattern = r'([.!?]+\s+|$)'
-    sentences = re.split(sentence_pattern, text)
+    chunk_count = 0
     
-    # Reconstruct sentences (pattern includes delimiters)
-    reconstructed_sentences = []
-    for i in range(0, len(sentences) - 1, 2):
-        if i + 1 < len(sentences):
-            reconstructed_sentences.append(sentences[i] + sentences[i + 1])
-        else:
-            reconstructed_sentences.append(sentences[i])
+    # Sentence end offsets (the pattern's final empty match always yields len(text)),
+    # so sentences are text[previous_end:end] slices and no sentence list is built
+    sentence_ends = [match.end() for match in _SENTENCE_END_RE.finditer(text)]
     
     # If we have sentence boundaries, try to group them into chunks
-    if len(reconstructed_sentences) > 1:
-        current_chunk = ""
-        chunk_index = 0
+    if len(sentence_ends) > 1:
+        chunk_start = 0
+        sentence_start = 0
         
-        for sentence in reconstructed_sentences:
-            # If adding this sentence would exceed threshold, save current chunk
-            if current_chunk and len(current_chunk) + len(sentence) > threshold:
-                chunks.append((current_chunk.strip(), chunk_index))
-                current_chunk = sentence
-                chunk_index += 1
-            else:
-                current_chunk += sentence
+        for sentence_end in sentence_ends:
+            # If adding this sentence would exceed threshold, emit current chunk
+            if sentence_start > chunk_start and sentence_end - chunk_start > threshold:
+                yield (text[chunk_start:sentence_start].strip(), chunk_count)
+                chunk_start = sentence_start
+                chunk_count += 1
+            sentence_start = sentence_end
         
-        # Add remaining chunk
-        if current_chunk.strip():
-            chunks.append((current_chunk.strip(), chunk_index))
+        # Emit remaining chunk
+        remaining = text[chunk_start:].strip()
+        if remaining:
+            yield (remaining, chunk_count)
+            chunk_count += 1
     else:
         # No sentence boundaries found, split at character threshold
         for i in range(0, len(text), threshold):
             chunk = text[i:i + threshold]
             if chunk.strip():
-                chunks.append((chunk.strip(), len(chunks)))
+                yield (chunk.strip(), chunk_count)
+                chunk_count += 1
     
-    return chunks if chunks else [(text, 0)]
+    if not chunk_count:
+        yield (text, 0)
 
 
-def embed_conversation_messages(conversation_id: str, user_id: str = None, model_tag: str = 'e5') -> Dict:
+def embed_conversation_messages(
+    conversation_id: str,
+    user_id: str = None,
+    model_tag: str = 'e5',
+    max_workers: int = EMBEDDING_STORE_MAX_WORKERS,
+    messages: Optional[List[Dict]] = None
+) -> Dict:
     """
     Embed user messages from a specific conversation.
     
     This function:
     1. Fetches user_id from conversation_id (if not provided)
     2. Validates conversation ownership (if user_id provided)
-    3. Fetches user messages for the conversation
+    3. Fetches user messages for the conversation (unless messages are passed in)
     4. Filters and normalizes messages
     5. Chunks long messages (>500 chars)
-    6. Generates embeddings for each chunk
-    7. Stores embeddings in wb_embeddings table (with idempotence check)
+    6. Generates embeddings for all new chunks in batched model calls
+    7. Stores embeddings in wb_embeddings table (with idempotence check); each
+       batch is uploaded in the background while the next batch is being encoded
     
     Args:
         conversation_id: UUID of the conversation
         user_id: Optional UUID of the user. If not provided, will be fetched from conversation.
                  If provided, will validate that conversation belongs to this user.
         model_tag: Model tag for embeddings ('miniLM' or 'e5'), default 'e5'
+        max_workers: Maximum number of embedding batches uploaded concurrently
+        messages: Optional user-role messages of this conversation already in hand
+                  (dicts with "id" and "text"), in which case they are not re-fetched.
+                  Idempotence is unchanged: already embedded chunks are still skipped.
     
     Returns:
         Dictionary with metadata:
@@ -266,9 +252,11 @@ def embed_conversation_messages(conversation_id: str, user_id: str = None, model
             )
         logger.info(f"Validated conversation {conversation_id} belongs to user {user_id}")
     
-    # Load messages for this conversation (with validation)
-    logger.info(f"Loading messages for conversation {conversation_id} (user {user_id})")
-    messages = database.load_conversation_messages(conversation_id, user_id=user_id)
+    if messages is None:
+        # Load messages for this conversation (ownership was resolved/validated above, so
+        # user_id is not passed again; that would repeat the wb_conversation lookup)
+        logger.info(f"Loading messages for conversation {conversation_id} (user {user_id})")
+        messages = database.load_conversation_messages(conversation_id, columns="id, text")
     
     if not messages:
         logger.warning(f"No messages found for conversation {conversation_id}")
@@ -279,18 +267,24 @@ def embed_conversation_messages(conversation_id: str, user_id: str = None, model
             "messages_skipped": 0
         }
     
-    # Extract message texts
-    message_texts = [msg["text"] for msg in messages if msg.get("text")]
-    
-    if not message_texts:
+    # Extract, filter (discard short ones) and normalize in one pass, keeping each message's id
+    text_count = 0
+    normalized_messages = []
+    for msg in messages:
+        text = msg.get("text")
+        if not text:
+            continue
+        text_count += 1
+        normalized_text = _prepare_message(text, min_words=4)
+        if normalized_text is not None:
+            normalized_messages.append((msg["id"], normalized_text))
+    
+    if not text_count:
         raise ValueError(f"No message texts found for conversation {conversation_id}")
     
-    logger.info(f"Found {len(message_texts)} messages for conversation {conversation_id}")
-    
-    # Filter messages (discard short ones)
-    filtered_messages = _filter_messages(message_texts, min_words=4)
+    logger.info(f"Found {text_count} messages for conversation {conversation_id}")
     
-    if not filtered_messages:
+    if not normalized_messages:
         logger.warning(f"No messages with sufficient length for conversation {conversation_id}")
         return {
             "messages_processed": 0,
@@ -299,67 +293,93 @@ def embed_conversation_messages(conversation_id: str, user_id: str = None, model
             "messages_skipped": 0
         }
     
-    logger.info(f"After filtering: {len(filtered_messages)} messages")
+    logger.info(f"After filtering: {len(normalized_messages)} messages")
     
-    # Normalize messages
-    normalized_messages = [_normalize_message(msg) for msg in filtered_messages]
-    
-    # Process each message: chunk, check idempotence, generate embeddings
+    # Process each message: chunk and collect every chunk with its ref_id
     messages_processed = 0
     chunks_created = 0
     embeddings_stored = 0
     messages_skipped = 0
+    pending = []  # (ref_id, chunk_text)
     
-    for i, normalized_text in enumerate(normalized_messages):
-        message_id = messages[i]["id"]
+    for message_id, normalized_text in normalized_messages:
         
-        # Chunk message if needed
-        chunks = _chunk_message(normalized_text, threshold=500)
-        chunks_created += len(chunks)
+        # Chunk message if needed (peek at the second chunk to know whether it was split)
+        chunks = _iter_chunks(normalized_text, threshold=500)
+        first_chunk = next(chunks)
+        second_chunk = next(chunks, None)
+        if second_chunk is None:
+            # Unchunked messages use the message id as ref_id
+            chunks_created += 1
+            pending.append((message_id, first_chunk[0]))
+        else:
+            # For chunked messages, create a unique ref_id per chunk: a deterministic UUID v5
+            # from message_id (as namespace, parsed once per message) + chunk_index.
+            # This ensures same chunk always gets same ref_id for idempotence
+            namespace = uuid.UUID(message_id)
+            for chunk_text, chunk_index in chain((first_chunk, second_chunk), chunks):
+                chunks_created += 1
+                pending.append((str(uuid.uuid5(namespace, str(chunk_index))), chunk_text))
         
-        # Process each chunk
-        for chunk_text, chunk_index in chunks:
-            # For chunked messages, create a unique ref_id
-            # Generate deterministic UUID from message_id and chunk_index
-            if len(chunks) > 1:
-                # Create deterministic UUID v5 from message_id (as namespace) + chunk_index
-                # This ensures same chunk always gets same ref_id for idempotence
-                namespace = uuid.UUID(message_id)
-                ref_id = str(uuid.uuid5(namespace, str(chunk_index)))
-            else:
-                ref_id = message_id
-            
-            # Check if embedding already exists (idempotence)
-            if database.check_embedding_exists(ref_id, model_tag):
-                logger.debug(f"Embedding already exists for ref_id {ref_id}, skipping")
-                messages_skipped += 1
-                continue
-            
-            # Generate embedding
+        messages_processed += 1
+    
+    # Check which chunks are already embedded (idempotence) in one bulk lookup
+    existing_ref_ids = database.existing_embedding_ref_ids(
+        [ref_id for ref_id, _ in pending],
+        model_tag
+    )
+    if existing_ref_ids:
+        messages_skipped = len(existing_ref_ids)
+        
+        # Replays of an already embedded conversation stop here, before any model work
+        if messages_skipped == len(pending):
+            logger.info(
+                f"All {chunks_created} chunks of conversation {conversation_id} are already embedded, "
+                f"{messages_processed} messages processed, nothing to store"
+            )
+            return {
+                "messages_processed": messages_processed,
+                "chunks_created": chunks_created,
+                "embeddings_stored": 0,
+                "messages_skipped": messages_skipped,
+                "user_id": user_id
+            }
+        
+        logger.debug(f"Embeddings already exist for {messages_skipped} chunks, skipping")
+        pending = [item for item in pending if item[0] not in existing_ref_ids]
+    
+    # Encode new chunks one model batch at a time; each batch's bulk upsert runs on the
+    # pool while the next batch is encoded, so network time overlaps model time
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        store_futures = []
+        for i in range(0, len(pending), EMBEDDING_BATCH_SIZE):
+            batch = pending[i:i + EMBEDDING_BATCH_SIZE]
             try:
-                vector = generate_embedding(chunk_text, model_tag=model_tag)
-                
-                # Store embedding
-                success = database.store_embedding(
-                    user_id=user_id,
-                    kind="message",
-                    ref_id=ref_id,
-                    vector=vector,
-                    model_tag=model_tag
+                vectors = generate_embeddings_batch(
+                    [chunk_text for _, chunk_text in batch],
+                    model_tag=model_tag,
+                    batch_size=EMBEDDING_BATCH_SIZE
                 )
-                
-                if success:
-                    embeddings_stored += 1
-                    logger.debug(f"Stored embedding for ref_id {ref_id}")
-                else:
-                    logger.warning(f"Failed to store embedding for ref_id {ref_id}")
-                    
             except Exception as e:
-                logger.error(f"Failed to generate/store embedding for ref_id {ref_id}: {e}")
-                # Continue with next chunk instead of failing entirely
+                logger.error(f"Failed to generate embeddings for conversation {conversation_id}: {e}")
+                # Continue with next batch instead of failing entirely
                 continue
+            
+            store_futures.append(executor.submit(
+                database.store_embeddings,
+                user_id=user_id,
+                kind="message",
+                embeddings=[(ref_id, vector) for (ref_id, _), vector in zip(batch, vectors)],
+                model_tag=model_tag
+            ))
         
-        messages_processed += 1
+        embeddings_stored = sum(future.result() for future in store_futures)
+    
+    if embeddings_stored < len(pending):
+        logger.warning(
+            f"Stored only {embeddings_stored}/{len(pending)} embeddings "
+            f"for conversation {conversation_id}"
+        )
     
     logger.info(
         f"Completed embedding for conversation {conversation_id}: "
@@ -4,22 +4,65 @@ Title Generator Module
 This module generates meaningful, concise titles for journal entries using LLM.
 """
 
-import os
 import logging
+from functools import lru_cache
 from typing import Optional
-from dotenv import load_dotenv
-from langdetect import detect, LangDetectException
+from langdetect import detect, DetectorFactory, LangDetectException
 
-from utils.llm import DeepSeekClient
+from utils.bootstrap import ensure_loaded
+from utils.llm import get_deepseek_api_key, get_deepseek_client
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Setup logging (only if not already configured)
-if not logging.getLogger().handlers:
-    logging.basicConfig(level=logging.INFO)
+# Load environment variables and default logging configuration (once per process)
+ensure_loaded()
 logger = logging.getLogger(__name__)
 
+# langdetect samples n-grams randomly; a fixed seed makes mixed-language journal
+# bodies (e.g. Malay/English) always detect the same way
+DetectorFactory.seed = 0
+
+# Number of leading characters used for language detection (langdetect cost grows with
+# text length; the first few hundred characters are enough for a stable result)
+LANGUAGE_DETECT_SAMPLE_CHARS = 500
+
+# Detected languages cached per sample (detection is deterministic with the fixed seed)
+LANGUAGE_DETECT_CACHE_SIZE = 1024
+
+# Map langdetect language codes to language names
+LANGDETECT_LANGUAGE_NAMES = {
+    'en': 'English',
+    'zh-cn': 'Chinese',
+    'zh-tw': 'Chinese',
+    'ms': 'Malay',  # Bahasa Malaysia
+    'id': 'Malay',  # Indonesian (close enough, can generate Malay titles)
+    'zh': 'Chinese',  # Generic Chinese
+}
+
+# Title language instruction per detected language (other languages are named directly)
+TITLE_LANGUAGE_INSTRUCTIONS = {
+    "Chinese": "请用中文生成标题。",
+    "Malay": "Jana tajuk dalam Bahasa Malaysia.",
+    "English": "Generate the title in English.",
+}
+
+# Prompt for journal title generation; constant text is built once at import and
+# filled with str.format (parsed in C, unlike string.Template's regex substitution)
+TITLE_PROMPT_TEMPLATE = """You are a helpful assistant that generates concise, meaningful titles for journal entries.
+
+Journal Entry Content:
+{body_preview}
+
+Task: Generate a single, concise title that meaningfully describes the main theme or content of this journal entry.
+
+Requirements:
+- {language_instruction}
+- The title should be concise (preferably under 10 words or 20 characters for Chinese/Malay)
+- The title should capture the main theme, emotion, or topic discussed
+- Do not include quotation marks, dates, or timestamps
+- Do not include phrases like "Journal entry about" or "My thoughts on"
+- Output only the title text, nothing else
+
+Title:"""
+
 
 def detect_language(text: str) -> str:
     """
@@ -34,23 +77,27 @@ def detect_language(text: str) -> str:
     if not text or not text.strip():
         return "English"  # Default fallback
     
+    return _detect_sample_language(text[:LANGUAGE_DETECT_SAMPLE_CHARS])
+
+
+@lru_cache(maxsize=LANGUAGE_DETECT_CACHE_SIZE)
+def _detect_sample_language(sample: str) -> str:
+    """
+    Detect the language of a leading text sample (cached, see detect_language).
+    
+    Args:
+        sample: First LANGUAGE_DETECT_SAMPLE_CHARS characters of the text
+        
+    Returns:
+        Language name (e.g., "English", "Chinese", "Malay")
+    """
     try:
         # Use langdetect to detect language code
-        lang_code = detect(text)
+        lang_code = detect(sample)
         logger.debug(f"langdetect detected language code: {lang_code}")
         
-        # Map language codes to language names
-        language_map = {
-            'en': 'English',
-            'zh-cn': 'Chinese',
-            'zh-tw': 'Chinese',
-            'ms': 'Malay',  # Bahasa Malaysia
-            'id': 'Malay',  # Indonesian (close enough, can generate Malay titles)
-            'zh': 'Chinese',  # Generic Chinese
-        }
-        
         # Get language name from map, or use the code itself
-        language_name = language_map.get(lang_code, lang_code)
+        language_name = LANGDETECT_LANGUAGE_NAMES.get(lang_code, lang_code)
         
         # If not in map, try to infer from code prefix
         if language_name == lang_code:
@@ -91,10 +138,8 @@ def generate_journal_title(body: str) -> str:
         ValueError: If API key is missing or body is empty
         Exception: If LLM API call fails
     """
-    # Load API key
-    api_key = os.getenv("DEEPSEEK_API_KEY")
-    if not api_key:
-        raise ValueError("DEEPSEEK_API_KEY environment variable is required")
+    # Fail fast if the API key is missing (cached per process)
+    get_deepseek_api_key()
     
     if not body or not body.strip():
         raise ValueError("Journal body cannot be empty")
@@ -112,36 +157,16 @@ def generate_journal_title(body: str) -> str:
         logger.debug(f"Truncated body from {len(body)} to {len(body_preview)} chars for title generation")
     
     # Create prompt for title generation
-    language_instruction = ""
-    if detected_language == "Chinese":
-        language_instruction = "请用中文生成标题。"
-    elif detected_language == "Malay":
-        language_instruction = "Jana tajuk dalam Bahasa Malaysia."
-    elif detected_language == "English":
-        language_instruction = "Generate the title in English."
-    else:
-        language_instruction = f"Generate the title in {detected_language}."
-    
-    prompt = f"""You are a helpful assistant that generates concise, meaningful titles for journal entries.
-
-Journal Entry Content:
-{body_preview}
-
-Task: Generate a single, concise title that meaningfully describes the main theme or content of this journal entry.
-
-Requirements:
-- {language_instruction}
-- The title should be concise (preferably under 10 words or 20 characters for Chinese/Malay)
-- The title should capture the main theme, emotion, or topic discussed
-- Do not include quotation marks, dates, or timestamps
-- Do not include phrases like "Journal entry about" or "My thoughts on"
-- Output only the title text, nothing else
-
-Title:"""
+    language_instruction = TITLE_LANGUAGE_INSTRUCTIONS.get(
+        detected_language, f"Generate the title in {detected_language}."
+    )
+    prompt = TITLE_PROMPT_TEMPLATE.format(
+        body_preview=body_preview,
+        language_instruction=language_instruction
+    )
 
-    # Initialize LLM client with faster model for simple tasks
-    logger.info("Initializing DeepSeek client for title generation")
-    client = DeepSeekClient(api_key=api_key, model="deepseek-chat", timeout=30.0)
+    # Reuse the cached LLM client (faster model for simple tasks)
+    client = get_deepseek_client("deepseek-chat", 30.0)
     
     # Generate title using LLM
     logger.info("Generating title with LLM")
@@ -154,11 +179,11 @@ Title:"""
         
         # Clean up the title (remove quotes, extra whitespace)
         title = generated_title.strip()
-        # Remove surrounding quotes if present
-        if title.startswith('"') and title.endswith('"'):
-            title = title[1:-1]
-        if title.startswith("'") and title.endswith("'"):
-            title = title[1:-1]
+        # Remove surrounding "..." then '...' quotes if present (matched pairs only, so
+        # a title ending in a quoted word keeps its closing quote)
+        for quote in '"\'':
+            if len(title) > 1 and title[0] == quote and title[-1] == quote:
+                title = title[1:-1]
         title = title.strip()
         
         # Enforce max length (100 chars)
@@ -7,7 +7,7 @@ emotion predictions from multiple modalities.
 
 import logging
 from typing import List, Dict, Optional, Tuple
-from collections import defaultdict
+from collections import Counter, defaultdict
 
 from fusion.config_loader import load_config
 from fusion.models import ModelSignal
@@ -34,6 +34,10 @@ VALID_EMOTIONS = ["Angry", "Sad", "Happy", "Fear"]
 # Negative emotions (critical emotions that require attention)
 NEGATIVE_EMOTIONS = ["Angry", "Sad", "Fear"]
 
+# Set views of the label lists for per-signal membership checks
+_VALID_EMOTION_SET = frozenset(VALID_EMOTIONS)
+_NEGATIVE_EMOTION_SET = frozenset(NEGATIVE_EMOTIONS)
+
 
 def calculate_mood_score(emotion_confidences: Dict[str, float]) -> int:
     """
@@ -87,11 +91,12 @@ def calculate_mood_score(emotion_confidences: Dict[str, float]) -> int:
     # Scale to 0-100 range
     mood_score = int(round((raw_mood + 1) * 50))
     
-    logger.debug(
-        f"Mood score calculation: Happy={happy_confidence:.3f}, "
-        f"Negatives=[Sad={sad_confidence:.3f}, Angry={anger_confidence:.3f}, Fear={fear_confidence:.3f}], "
-        f"AvgNegative={avg_negative:.3f}, RawMood={raw_mood:.3f}, MoodScore={mood_score}"
-    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            f"Mood score calculation: Happy={happy_confidence:.3f}, "
+            f"Negatives=[Sad={sad_confidence:.3f}, Angry={anger_confidence:.3f}, Fear={fear_confidence:.3f}], "
+            f"AvgNegative={avg_negative:.3f}, RawMood={raw_mood:.3f}, MoodScore={mood_score}"
+        )
     
     return mood_score
 
@@ -127,7 +132,7 @@ def calculate_negative_emotion_consensus(
         # Check if this modality has any negative emotions
         modality_negative_sum = 0.0
         for emotion, confidence in emotion_scores.items():
-            if emotion in NEGATIVE_EMOTIONS:
+            if emotion in _NEGATIVE_EMOTION_SET:
                 modality_negative_sum += confidence
         
         if modality_negative_sum > 0.0:
@@ -228,33 +233,46 @@ def fuse_signals(signals: List[ModelSignal], weights: Optional[Dict[str, float]]
     
     weights = weights or FUSION_WEIGHTS
     
-    # Step 1: Group signals by modality
-    modality_signals = defaultdict(list)
-    for signal in signals:
-        modality_signals[signal.modality].append(signal)
-    
-    logger.debug(f"Grouped signals by modality: {dict((k, len(v)) for k, v in modality_signals.items())}")
+    # Per-step debug lines are buffered and emitted as one record (only when DEBUG is enabled)
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
+    debug_lines = []
     
-    # Step 2: Aggregate predictions per modality (average confidence per emotion)
-    modality_emotions = defaultdict(lambda: defaultdict(list))
+    # Steps 1-2: Group signals by modality and emotion in a single pass, keeping a running
+    # [confidence_sum, count] per emotion instead of per-emotion lists of confidences
+    # (modalities keep first-appearance order, as when grouping by modality first)
+    modality_totals: Dict[str, Dict[str, List[float]]] = {}
+    for signal in signals:
+        emotion_totals = modality_totals.setdefault(signal.modality, {})
+        
+        # Validate emotion label
+        emotion = signal.emotion_label
+        if emotion not in _VALID_EMOTION_SET:
+            logger.warning(f"Invalid emotion label '{emotion}' from {signal.modality}, skipping")
+            continue
+        
+        totals = emotion_totals.get(emotion)
+        if totals is None:
+            emotion_totals[emotion] = [signal.confidence, 1]
+        else:
+            totals[0] += signal.confidence
+            totals[1] += 1
     
-    for modality, modality_signal_list in modality_signals.items():
-        for signal in modality_signal_list:
-            # Validate emotion label
-            if signal.emotion_label not in VALID_EMOTIONS:
-                logger.warning(f"Invalid emotion label '{signal.emotion_label}' from {modality}, skipping")
-                continue
-            
-            modality_emotions[modality][signal.emotion_label].append(signal.confidence)
+    if debug_enabled:
+        logger.debug(f"Grouped signals by modality: {dict(Counter(signal.modality for signal in signals))}")
     
     # Step 3: Calculate average confidence per emotion per modality
-    modality_scores = defaultdict(dict)
+    # (modalities without any valid signal are left out)
+    modality_scores: Dict[str, Dict[str, float]] = {}
     
-    for modality, emotions_dict in modality_emotions.items():
-        for emotion, confidences in emotions_dict.items():
-            avg_confidence = sum(confidences) / len(confidences)
-            modality_scores[modality][emotion] = avg_confidence
-            logger.debug(f"{modality} -> {emotion}: avg_confidence={avg_confidence:.3f} (from {len(confidences)} signals)")
+    for modality, emotion_totals in modality_totals.items():
+        if not emotion_totals:
+            continue
+        emotion_scores = modality_scores[modality] = {}
+        for emotion, (confidence_sum, count) in emotion_totals.items():
+            avg_confidence = confidence_sum / count
+            emotion_scores[emotion] = avg_confidence
+            if debug_enabled:
+                debug_lines.append(f"{modality} -> {emotion}: avg_confidence={avg_confidence:.3f} (from {count} signals)")
     
     # Step 4: Apply weights and calculate weighted scores per emotion
     emotion_weighted_scores = defaultdict(float)
@@ -268,7 +286,11 @@ def fuse_signals(signals: List[ModelSignal], weights: Optional[Dict[str, float]]
         for emotion, avg_confidence in emotion_scores.items():
             weighted_contribution = avg_confidence * modality_weight
             emotion_weighted_scores[emotion] += weighted_contribution
-            logger.debug(f"{emotion} += {modality} ({avg_confidence:.3f} * {modality_weight:.2f}) = {weighted_contribution:.3f}")
+            if debug_enabled:
+                debug_lines.append(f"{emotion} += {modality} ({avg_confidence:.3f} * {modality_weight:.2f}) = {weighted_contribution:.3f}")
+    
+    if debug_lines:
+        logger.debug("Fusion aggregation:\n" + "\n".join(debug_lines))
     
     if not emotion_weighted_scores:
         raise ValueError("No valid emotion scores after aggregation")
@@ -231,6 +231,10 @@ async def process_emotion_snapshot(request: EmotionSnapshotRequest) -> Union[Fus
         filtered_signals = []
         effective_start_ts = effective_start.timestamp()
         snapshot_ts = snapshot_timestamp.timestamp()
+        # Collect out-of-window timestamps and emit them in one debug record
+        # (only when DEBUG is enabled, so production skips the formatting)
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        out_of_window = []
         
         for signal in all_signals:
             try:
@@ -244,13 +248,16 @@ async def process_emotion_snapshot(request: EmotionSnapshotRequest) -> Union[Fus
                 # Signal must be after effective_start and before/equal to snapshot_timestamp
                 if effective_start_ts < signal_ts <= snapshot_ts:
                     filtered_signals.append(signal)
-                else:
-                    logger.debug(f"Filtered out signal outside effective window: {signal.timestamp} (window: [{effective_start.isoformat()}, {snapshot_timestamp.isoformat()}])")
+                elif debug_enabled:
+                    out_of_window.append(signal.timestamp)
             except Exception as e:
                 logger.warning(f"Failed to parse signal timestamp {signal.timestamp}: {e}")
                 # Include it anyway (database query should have validated)
                 filtered_signals.append(signal)
         
+        if out_of_window:
+            logger.debug(f"Filtered out {len(out_of_window)} signals outside effective window "
+                        f"[{effective_start.isoformat()}, {snapshot_timestamp.isoformat()}]: {out_of_window}")
         logger.debug(f"After time window validation: {len(filtered_signals)} signals")
         
         # Step 4: Check minimum signals requirement
@@ -9,6 +9,8 @@ import os
 import logging
 from typing import Dict, Any
 
+from utils.json_io import load_json_file
+
 logger = logging.getLogger(__name__)
 
 # Default configuration (used as fallback)
@@ -85,18 +87,16 @@ def load_config(config_path: str = None) -> Dict[str, Any]:
         module_dir = os.path.dirname(os.path.abspath(__file__))
         config_path = os.path.join(module_dir, "config.json")
     
-    # Try to load config file
+    # Try to load config file (a single open instead of an exists() check first)
     try:
-        if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-            logger.info(f"Loaded configuration from {config_path}")
-            _config_cache = config
-            return config
-        else:
-            logger.warning(f"Config file not found at {config_path}, using default configuration")
-            _config_cache = DEFAULT_CONFIG
-            return DEFAULT_CONFIG
+        config = load_json_file(config_path)
+        logger.info(f"Loaded configuration from {config_path}")
+        _config_cache = config
+        return config
+    except FileNotFoundError:
+        logger.warning(f"Config file not found at {config_path}, using default configuration")
+        _config_cache = DEFAULT_CONFIG
+        return DEFAULT_CONFIG
     except json.JSONDecodeError as e:
         logger.error(f"Invalid JSON in config file {config_path}: {e}. Using default configuration.")
         _config_cache = DEFAULT_CONFIG
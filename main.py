@@ -6,11 +6,18 @@ This script orchestrates all routes and runs the FastAPI server on port 8000.
 
 from fastapi import FastAPI, HTTPException
 import uvicorn
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Import modules
-from utils import database, schemas, activity_logger
+from utils import database, schemas, activity_logger, vector_search
 from utils import dashboard as dashboard_module
 from context_generator import context_extractor, facts_extractor, message_preprocessor, title_generator
 from intervention import intervention
@@ -18,11 +25,26 @@ from fusion import api as fusion_api
 from utils.database import get_malaysia_timezone
 
 # Setup logging with timestamps
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)-8s | %(name)-20s | %(message)s",
+# Records are handed to a QueueListener thread that formats and writes them, so
+# request handlers never block on console I/O. The queue handler replaces the
+# default handler installed by utils.bootstrap when the modules above were imported
+# (not via basicConfig, which would give it a second formatter)
+_log_queue = queue.SimpleQueue()
+_console_handler = logging.StreamHandler()
+_console_handler.setFormatter(logging.Formatter(
+    fmt="%(asctime)s | %(levelname)-8s | %(name)-20s | %(message)s",
     datefmt="%Y-%m-%d %H:%M:%S"
-)
+))
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_log_listener = logging.handlers.QueueListener(_log_queue, _console_handler)
+_root_logger = logging.getLogger()
+for _handler in _root_logger.handlers[:]:
+    _root_logger.removeHandler(_handler)
+    _handler.close()
+_root_logger.addHandler(_queue_handler)
+_root_logger.setLevel(logging.INFO)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Create FastAPI app instance
@@ -32,6 +54,44 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Embed the extractors' focus areas in the background at startup, so the first
+# /api/context/process request does not pay for model loading and query embedding
+WARMUP_QUERY_EMBEDDINGS = os.getenv("WARMUP_QUERY_EMBEDDINGS", "true").lower() == "true"
+
+
+def _warmup_focus_area_embeddings():
+    """Load the embedding model and cache the focus-area query embeddings."""
+    try:
+        vector_search.warmup_queries(facts_extractor.FACTS_FOCUS_AREAS + context_extractor.CONTEXT_FOCUS_AREAS)
+        logger.info("Focus-area query embeddings cached")
+    except Exception as e:
+        logger.warning(f"Failed to warm up focus-area query embeddings: {e}")
+
+
+@app.on_event("startup")
+async def warmup_query_embeddings():
+    """Start the focus-area embedding warmup without blocking server startup."""
+    if WARMUP_QUERY_EMBEDDINGS:
+        threading.Thread(target=_warmup_focus_area_embeddings, daemon=True).start()
+
+
+def _run_timed(func, *args):
+    """
+    Run a function and measure its duration, capturing any exception.
+    
+    Args:
+        func: Function to run
+        *args: Positional arguments passed to func
+    
+    Returns:
+        Tuple of (result, exception, duration_seconds); result is None on failure
+    """
+    start = time.perf_counter()
+    try:
+        return func(*args), None, time.perf_counter() - start
+    except Exception as e:
+        return None, e, time.perf_counter() - start
+
 
 @app.get("/")
 async def root():
@@ -134,49 +194,45 @@ async def process_user_context(request: schemas.ProcessContextRequest):
             logger.info("[Step 0] Embedding Messages")
             logger.info("  → Skipped (no conversation_id provided)")
         
-        # Step 1: Extract persona facts (using semantic vector search)
-        facts_start = datetime.now()
-        logger.info("")
-        logger.info("[Step 1] Extracting Persona Facts")
-        logger.info(f"  User: {actual_user_id}")
-        logger.info("  → Queried 6 focus areas (communication style, interests, personality traits, values, characteristics, behavioural patterns)")
-        try:
-            facts = facts_extractor.extract_user_facts(actual_user_id)
-            facts_end = datetime.now()
-            facts_duration = (facts_end - facts_start).total_seconds()
-            facts_length = len(facts) if facts else 0
-            facts_preview = facts[:200] + "..." if facts and len(facts) > 200 else (facts if facts else "")
-            logger.info(f"  → Facts summary: {facts_length:,} characters")
-            if facts_preview:
-                logger.info(f"  → Preview: {facts_preview}")
-            logger.info(f"  ✓ Completed in {facts_duration:.2f}s")
-        except Exception as e:
-            facts_end = datetime.now()
-            facts_duration = (facts_end - facts_start).total_seconds()
-            logger.error(f"  ✗ Failed after {facts_duration:.2f}s: {e}")
-            # Don't raise - allow context extraction to proceed
-        
-        # Step 2: Extract daily life context (using semantic vector search)
-        context_start = datetime.now()
-        logger.info("")
-        logger.info("[Step 2] Extracting Daily Life Context")
-        logger.info(f"  User: {actual_user_id}")
-        logger.info("  → Queried 6 focus areas (routines, stories, relationships, work, events, activities)")
-        try:
-            persona_summary = context_extractor.process_user_context(actual_user_id)
-            context_end = datetime.now()
-            context_duration = (context_end - context_start).total_seconds()
-            context_length = len(persona_summary) if persona_summary else 0
-            context_preview = persona_summary[:200] + "..." if persona_summary and len(persona_summary) > 200 else (persona_summary if persona_summary else "")
-            logger.info(f"  → Context summary: {context_length:,} characters")
-            if context_preview:
-                logger.info(f"  → Preview: {context_preview}")
-            logger.info(f"  ✓ Completed in {context_duration:.2f}s")
-        except Exception as e:
-            context_end = datetime.now()
-            context_duration = (context_end - context_start).total_seconds()
-            logger.error(f"  ✗ Failed after {context_duration:.2f}s: {e}")
-            raise
+        # Steps 1 and 2 are independent (each does its own retrieval and LLM call),
+        # so run them concurrently and report their results in order
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            facts_future = executor.submit(_run_timed, facts_extractor.extract_user_facts, actual_user_id)
+            context_future = executor.submit(_run_timed, context_extractor.process_user_context, actual_user_id)
+            
+            # Step 1: Extract persona facts (using semantic vector search)
+            logger.info("")
+            logger.info("[Step 1] Extracting Persona Facts")
+            logger.info(f"  User: {actual_user_id}")
+            logger.info("  → Queried 6 focus areas (communication style, interests, personality traits, values, characteristics, behavioural patterns)")
+            facts, facts_error, facts_duration = facts_future.result()
+            if facts_error is None:
+                facts_length = len(facts) if facts else 0
+                facts_preview = facts[:200] + "..." if facts and len(facts) > 200 else (facts if facts else "")
+                logger.info(f"  → Facts summary: {facts_length:,} characters")
+                if facts_preview:
+                    logger.info(f"  → Preview: {facts_preview}")
+                logger.info(f"  ✓ Completed in {facts_duration:.2f}s")
+            else:
+                logger.error(f"  ✗ Failed after {facts_duration:.2f}s: {facts_error}")
+                # Don't raise - allow context extraction to proceed
+            
+            # Step 2: Extract daily life context (using semantic vector search)
+            logger.info("")
+            logger.info("[Step 2] Extracting Daily Life Context")
+            logger.info(f"  User: {actual_user_id}")
+            logger.info("  → Queried 6 focus areas (routines, stories, relationships, work, events, activities)")
+            persona_summary, context_error, context_duration = context_future.result()
+            if context_error is None:
+                context_length = len(persona_summary) if persona_summary else 0
+                context_preview = persona_summary[:200] + "..." if persona_summary and len(persona_summary) > 200 else (persona_summary if persona_summary else "")
+                logger.info(f"  → Context summary: {context_length:,} characters")
+                if context_preview:
+                    logger.info(f"  → Preview: {context_preview}")
+                logger.info(f"  ✓ Completed in {context_duration:.2f}s")
+            else:
+                logger.error(f"  ✗ Failed after {context_duration:.2f}s: {context_error}")
+                raise context_error
         
         end_time = datetime.now()
         total_duration = (end_time - start_time).total_seconds()
@@ -0,0 +1,75 @@
+"""
+Unit Tests: context_extractor prompt helpers
+
+Offline tests for the helpers that shape the context prompt (no database or LLM calls).
+
+Run with: pytest test_context_prompt_helpers.py -v
+"""
+
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from context_generator.context_extractor import _cap_messages_to_token_budget, _parse_batch_summaries
+
+
+# Each 40-char message is estimated at 40 // 4 + 4 = 14 tokens
+OLD, MIDDLE, NEW = "a" * 40, "b" * 40, "c" * 40
+
+
+class TestCapMessagesToTokenBudget:
+    """Tests for _cap_messages_to_token_budget() (keeps the newest messages that fit)."""
+
+    def test_within_budget_keeps_all(self):
+        assert _cap_messages_to_token_budget([OLD, MIDDLE, NEW], 42) == [OLD, MIDDLE, NEW]
+
+    def test_empty_input(self):
+        assert _cap_messages_to_token_budget([], 10) == []
+
+    def test_over_budget_drops_oldest(self):
+        assert _cap_messages_to_token_budget([OLD, MIDDLE, NEW], 41) == [MIDDLE, NEW]
+
+    def test_budget_boundary_is_inclusive(self):
+        assert _cap_messages_to_token_budget([OLD, MIDDLE, NEW], 28) == [MIDDLE, NEW]
+        assert _cap_messages_to_token_budget([OLD, MIDDLE, NEW], 27) == [NEW]
+
+    def test_newest_message_alone_over_budget(self):
+        assert _cap_messages_to_token_budget([OLD, "x" * 400], 10) == []
+
+    def test_keeps_chronological_order(self):
+        texts = [f"message {i:02d}" for i in range(20)]
+        kept = _cap_messages_to_token_budget(texts, 35)
+        assert kept == texts[-len(kept):]
+
+
+class TestParseBatchSummaries:
+    """Tests for _parse_batch_summaries() (JSON object keyed by the batch's user ids)."""
+
+    def test_plain_json_object(self):
+        response = '{"u1": " Summary one ", "u2": "Summary two"}'
+        assert _parse_batch_summaries(response, {"u1", "u2"}) == {"u1": "Summary one", "u2": "Summary two"}
+
+    def test_code_fence_is_stripped(self):
+        response = '```json\n{"u1": "Summary one"}\n```'
+        assert _parse_batch_summaries(response, {"u1"}) == {"u1": "Summary one"}
+
+    def test_missing_and_empty_summaries_are_omitted(self):
+        response = '{"u1": "  ", "u2": null}'
+        assert _parse_batch_summaries(response, {"u1", "u2", "u3"}) == {}
+
+    def test_unknown_user_id_rejects_response(self):
+        response = '{"u1": "Summary one", "intruder": "Injected summary"}'
+        with pytest.raises(ValueError, match="unknown user ids"):
+            _parse_batch_summaries(response, {"u1", "u2"})
+
+    def test_non_object_rejected(self):
+        with pytest.raises(ValueError):
+            _parse_batch_summaries('["Summary one"]', {"u1"})
+
+    def test_invalid_json_rejected(self):
+        with pytest.raises(ValueError):
+            _parse_batch_summaries("Summary one", {"u1"})
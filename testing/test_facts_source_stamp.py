@@ -0,0 +1,66 @@
+"""
+Unit Tests: facts_extractor reuse checks
+
+Offline tests for the stamp and lookup that decide whether stored persona facts
+can be reused (no database or LLM calls).
+
+Run with: pytest test_facts_source_stamp.py -v
+"""
+
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_generator import facts_extractor
+from context_generator.facts_extractor import _facts_source_stamp, _stored_facts_if
+
+
+VERSION = "2026-01-01T00:00:00+00:00|42"
+
+
+class TestFactsSourceStamp:
+    """Tests for _facts_source_stamp() (prompt version, message cap, embeddings version, model, language)."""
+
+    def test_no_embeddings_version_gives_no_stamp(self):
+        assert _facts_source_stamp(None, "e5", "English") is None
+        assert _facts_source_stamp("", "e5", "English") is None
+
+    def test_stamp_is_stable(self):
+        assert _facts_source_stamp(VERSION, "e5", "English") == _facts_source_stamp(VERSION, "e5", "English")
+
+    def test_stamp_changes_with_each_input(self):
+        stamp = _facts_source_stamp(VERSION, "e5", "English")
+        assert _facts_source_stamp("2026-01-01T00:00:00+00:00|41", "e5", "English") != stamp
+        assert _facts_source_stamp("2026-01-02T00:00:00+00:00|42", "e5", "English") != stamp
+        assert _facts_source_stamp(VERSION, "miniLM", "English") != stamp
+        assert _facts_source_stamp(VERSION, "e5", "Malay") != stamp
+
+    def test_stamp_changes_with_prompt_version_and_cap(self, monkeypatch):
+        stamp = _facts_source_stamp(VERSION, "e5", "English")
+        monkeypatch.setattr(facts_extractor, "FACTS_PROMPT_VERSION", "edited")
+        assert _facts_source_stamp(VERSION, "e5", "English") != stamp
+        monkeypatch.undo()
+        monkeypatch.setattr(facts_extractor, "FACTS_MAX_PROMPT_MESSAGES", 1)
+        assert _facts_source_stamp(VERSION, "e5", "English") != stamp
+
+
+class TestStoredFactsIf:
+    """Tests for _stored_facts_if() (reuse only on an exact stamp/fingerprint match)."""
+
+    def test_matching_value_returns_facts(self):
+        bundle = {"facts": "Stored facts", "facts_source_stamp": "stamp"}
+        assert _stored_facts_if(bundle, "facts_source_stamp", "stamp") == "Stored facts"
+
+    def test_different_value_returns_none(self):
+        bundle = {"facts": "Stored facts", "facts_source_stamp": "old"}
+        assert _stored_facts_if(bundle, "facts_source_stamp", "new") is None
+
+    def test_missing_value_never_matches(self):
+        bundle = {"facts": "Stored facts", "facts_source_stamp": None}
+        assert _stored_facts_if(bundle, "facts_source_stamp", None) is None
+
+    def test_missing_bundle_or_facts_returns_none(self):
+        assert _stored_facts_if(None, "facts_fingerprint", "fp") is None
+        assert _stored_facts_if({"facts": "", "facts_fingerprint": "fp"}, "facts_fingerprint", "fp") is None
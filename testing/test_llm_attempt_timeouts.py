@@ -0,0 +1,51 @@
+"""
+Unit Tests: DeepSeekClient per-attempt timeouts
+
+Offline tests for the read-timeout schedule used by DeepSeekClient.chat() retries
+(no API calls).
+
+Run with: pytest test_llm_attempt_timeouts.py -v
+"""
+
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.llm import DeepSeekClient, REASONER_FIRST_ATTEMPT_TIMEOUT
+
+
+def make_client(model: str, timeout: float, max_retries: int) -> DeepSeekClient:
+    return DeepSeekClient(api_key="test-key", model=model, timeout=timeout, max_retries=max_retries)
+
+
+class TestAttemptTimeouts:
+    """Tests for DeepSeekClient._attempt_timeouts()."""
+
+    def test_reasoner_default_schedule(self):
+        client = make_client("deepseek-reasoner", 180.0, max_retries=1)
+        assert client._attempt_timeouts() == [REASONER_FIRST_ATTEMPT_TIMEOUT, 180.0]
+
+    def test_reasoner_grows_linearly_to_full_timeout(self):
+        client = make_client("deepseek-reasoner", 180.0, max_retries=2)
+        assert client._attempt_timeouts(60.0) == [60.0, 120.0, 180.0]
+
+    def test_last_attempt_gets_full_timeout(self):
+        client = make_client("deepseek-reasoner", 1440.0, max_retries=3)
+        timeouts = client._attempt_timeouts(480.0)
+        assert len(timeouts) == 4
+        assert timeouts[-1] == 1440.0
+        assert timeouts == sorted(timeouts)
+
+    def test_chat_model_keeps_full_timeout(self):
+        client = make_client("deepseek-chat", 30.0, max_retries=1)
+        assert client._attempt_timeouts() == [30.0, 30.0]
+
+    def test_single_attempt_keeps_full_timeout(self):
+        client = make_client("deepseek-reasoner", 180.0, max_retries=0)
+        assert client._attempt_timeouts() == [180.0]
+
+    def test_request_timeout_above_client_timeout(self):
+        client = make_client("deepseek-reasoner", 180.0, max_retries=1)
+        assert client._attempt_timeouts(300.0) == [180.0, 180.0]
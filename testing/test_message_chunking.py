@@ -0,0 +1,54 @@
+"""
+Unit Tests: message chunking for embeddings
+
+Pins the chunks (text and index) produced for long messages before they are
+embedded (no database or model calls).
+
+Run with: pytest test_message_chunking.py -v
+"""
+
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_generator.message_preprocessor import _iter_chunks
+
+
+SENTENCE = "First sentence here. "  # 21 chars
+
+
+class TestChunkMessage:
+    """Tests for _iter_chunks() (sentence-boundary chunking with a character fallback)."""
+
+    def test_short_text_is_single_chunk(self):
+        assert list(_iter_chunks("short text")) == [("short text", 0)]
+
+    def test_text_at_threshold_is_not_split(self):
+        text = "a" * 500
+        assert list(_iter_chunks(text)) == [(text, 0)]
+
+    def test_splits_at_sentence_boundaries(self):
+        # 23 sentences (483 chars) fit in 500; the remaining 7 go to the next chunk
+        assert list(_iter_chunks(SENTENCE * 30)) == [
+            ((SENTENCE * 23).strip(), 0),
+            ((SENTENCE * 7).strip(), 1),
+        ]
+
+    def test_keeps_text_after_last_boundary(self):
+        assert list(_iter_chunks("One. " * 5 + "tail", threshold=12)) == [
+            ("One. One.", 0),
+            ("One. One.", 1),
+            ("One. tail", 2),
+        ]
+
+    def test_no_boundary_splits_at_threshold(self):
+        assert list(_iter_chunks("x" * 1200)) == [
+            ("x" * 500, 0),
+            ("x" * 500, 1),
+            ("x" * 200, 2),
+        ]
+
+    def test_no_boundary_skips_blank_chunks(self):
+        assert list(_iter_chunks("y" * 10 + " " * 10, threshold=10)) == [("y" * 10, 0)]
@@ -8,6 +8,7 @@ Logs are stored in-memory for real-time dashboard monitoring (non-persistent).
 import logging
 import threading
 from collections import deque
+from itertools import islice
 from datetime import datetime
 from typing import Dict, Optional, Any
 
@@ -280,17 +281,13 @@ def read_activity_logs(
         activities, lock = _get_service_storage(service_name)
         
         with lock:
-            # Convert deque to list (deque maintains insertion order, newest last)
-            # We want newest first, so reverse it
-            all_entries = list(activities)
-            all_entries.reverse()  # Newest first
-        
-        # Filter by user_id if provided
-        if user_id:
-            all_entries = [entry for entry in all_entries if entry.get("user_id") == user_id]
-        
-        # Return last N entries (already newest first)
-        return all_entries[:limit]
+            # Walk the deque newest-first (newest entries are at the right end)
+            # and stop as soon as `limit` matching entries are collected,
+            # instead of copying, reversing and filtering the whole deque
+            entries = reversed(activities)
+            if user_id:
+                entries = (entry for entry in entries if entry.get("user_id") == user_id)
+            return list(islice(entries, limit))
         
     except Exception as e:
         logger.error(f"Error reading activity logs for service '{service_name}': {e}", exc_info=True)
@@ -0,0 +1,26 @@
+"""
+Bootstrap Script
+
+This script loads environment variables and configures default logging once per process.
+Modules call ensure_loaded() at import time instead of repeating load_dotenv()/basicConfig().
+"""
+
+import logging
+from functools import lru_cache
+from dotenv import load_dotenv
+
+
+@lru_cache(maxsize=1)
+def ensure_loaded() -> None:
+    """
+    Load the .env file and set up default logging (only on the first call).
+    
+    Logging is only configured if the root logger has no handlers yet, so an
+    application-level logging configuration is left untouched.
+    """
+    # Load environment variables from .env file
+    load_dotenv()
+    
+    # Setup logging (only if not already configured)
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO)
@@ -5,7 +5,8 @@ Provides a real-time monitoring dashboard for Fusion, Intervention, and Context
 """
 
 from fastapi import APIRouter
-from fastapi.responses import HTMLResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from typing import List, Dict, Optional
 from datetime import datetime
 import logging
@@ -17,6 +18,12 @@ from utils import database
 from fusion.config_loader import load_config as load_fusion_config
 from utils.database import get_malaysia_timezone
 
+# Use orjson for the polled status payload when available (faster C encoder)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/dashboard", tags=["Dashboard"])
@@ -856,6 +863,23 @@ async def check_model_service_health(url: str, service_name: str) -> Dict:
         }
 
 
+def _json_response(content: Dict) -> Response:
+    """
+    Serialize a dashboard payload, using orjson directly when available.
+    
+    Falls back to FastAPI's encoder for payloads orjson cannot serialize.
+    """
+    if orjson is not None:
+        try:
+            return Response(
+                content=orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS),
+                media_type="application/json"
+            )
+        except TypeError:
+            pass
+    return JSONResponse(content=jsonable_encoder(content))
+
+
 @router.get("/status")
 async def get_dashboard_status():
     """Get current dashboard status for all services."""
@@ -1159,7 +1183,7 @@ async def get_dashboard_status():
         intervention_last_hour = count_recent(intervention_activities)
         context_last_hour = count_recent(context_activities)
         
-        return {
+        return _json_response({
             "fusion": fusion_activities[:50],
             "intervention": intervention_activities[:50],
             "model_services": model_services_data,
@@ -1172,7 +1196,7 @@ async def get_dashboard_status():
                     "context_last_hour": context_last_hour
                 }
             }
-        }
+        })
         
     except Exception as e:
         logger.error(f"Error getting dashboard status: {e}", exc_info=True)
@@ -6,20 +6,96 @@ Combines database connection and message loading functionality.
 """
 
 import os
-from typing import Dict, List, Optional
-from supabase import create_client, Client
-from dotenv import load_dotenv
+import time
+import threading
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, List, Optional, Set, Tuple
+import httpx
+from supabase import create_client, Client, ClientOptions
+from postgrest.types import CountMethod, ReturnMethod
 import logging
 from datetime import datetime, timezone, timedelta
 
-# Load environment variables from .env file
-load_dotenv()
+from utils.bootstrap import ensure_loaded
 
-# Setup logging (only if not already configured)
-if not logging.getLogger().handlers:
-    logging.basicConfig(level=logging.INFO)
+# Load environment variables and default logging configuration (once per process)
+ensure_loaded()
 logger = logging.getLogger(__name__)
 
+# Cached Supabase clients keyed by service flag (reused across calls)
+_clients: Dict[bool, Client] = {}
+_clients_lock = threading.Lock()
+
+# Connection pool settings for the shared Supabase HTTP client
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "10"))
+SUPABASE_POOL_RECYCLE = float(os.getenv("SUPABASE_POOL_RECYCLE", "1800"))
+
+# Request timeout for the pooled client. 120s is postgrest-py's default client timeout,
+# i.e. what requests got before the pool was added; a shorter cap (e.g. 30s) would cut off
+# the heavy calls such as the match_embeddings vector-search RPC and whole-history message
+# loads for active users. Connecting stays bounded at 5s.
+SUPABASE_REQUEST_TIMEOUT = float(os.getenv("SUPABASE_REQUEST_TIMEOUT", "120"))
+SUPABASE_CONNECT_TIMEOUT = 5.0
+
+# Emotion labels accepted by the fusion service
+VALID_EMOTION_LABELS = ["Angry", "Sad", "Happy", "Fear"]
+# Hash set for the per-row fallback check (list membership scans every label)
+_VALID_EMOTION_LABEL_SET = frozenset(VALID_EMOTION_LABELS)
+
+# Maximum number of IDs per IN query (keeps request URLs bounded)
+MESSAGE_FETCH_BATCH_SIZE = 100
+
+# Rows per page when reading a user's messages (Supabase's default max-rows)
+MESSAGE_PAGE_SIZE = 1000
+
+# Maximum number of embedding rows per bulk write request (an e5 vector is ~10 KB of text)
+EMBEDDING_UPSERT_BATCH_SIZE = 100
+
+# Significant digits per vector component sent to pgvector (float4 round-trips through 9)
+VECTOR_SIGNIFICANT_DIGITS = 9
+_VECTOR_COMPONENT_FORMAT = f"%.{VECTOR_SIGNIFICANT_DIGITS}g"
+
+# PostgREST error code for "function not found"; once wb_user_conversations_with_user_messages
+# is known to be missing from the database, load_user_messages goes straight to the joined query
+_MISSING_FUNCTION_CODE = 'PGRST202'
+_messages_rpc_available = True
+
+# PostgREST error code for "column not found"; once the users_context_bundle fingerprint
+# columns (see utils/functions.sql) are known to be missing, bundle writes leave them out
+_MISSING_COLUMN_CODE = 'PGRST204'
+_BUNDLE_FINGERPRINT_COLUMNS = ("context_fingerprint", "facts_fingerprint", "facts_source_stamp")
+_bundle_fingerprint_columns_available = True
+
+# Postgres error code for "no unique or exclusion constraint matching the ON CONFLICT
+# specification"; once wb_embeddings is known to lack the (ref_id, model_tag) constraint
+# (see utils/functions.sql), store_embeddings uses plain inserts
+_NO_CONFLICT_TARGET_CODE = '42P10'
+_embedding_upsert_available = True
+
+# Per-process cache of users' preferred language: user_id -> (language, expires_at).
+# Entries expire so changes made in the app are picked up without a restart.
+USER_LANGUAGE_CACHE_TTL = float(os.getenv("USER_LANGUAGE_CACHE_TTL", "300"))
+USER_LANGUAGE_CACHE_SIZE = 1024
+_user_language_cache: Dict[str, Tuple[str, float]] = {}
+_user_language_cache_lock = threading.Lock()
+
+# Map language code/name to human-readable name for LLM prompts
+# Support both codes (en, zh, ms) and full names (English, Chinese, Malay)
+_LANGUAGE_NAMES = {
+    "en": "English",
+    "zh": "Chinese",
+    "ms": "Malay",
+    "zh-CN": "Chinese",
+    "zh-TW": "Chinese",
+    "ms-MY": "Malay",
+    # Also support full language names directly
+    "English": "English",
+    "Chinese": "Chinese",
+    "Malay": "Malay"
+}
+
 
 def get_malaysia_timezone():
     """
@@ -79,10 +155,14 @@ def parse_database_timestamp(timestamp_str: str) -> datetime:
     return timestamp
 
 
+@lru_cache(maxsize=1)
 def get_supabase_config() -> Dict[str, str]:
     """
     Get Supabase configuration from environment variables.
     
+    The result is cached per process; call get_supabase_config.cache_clear()
+    (or reset_supabase_client()) after changing the environment variables.
+    
     Returns:
         Dictionary with 'url' and 'service_role_key'
     
@@ -105,7 +185,10 @@ def get_supabase_config() -> Dict[str, str]:
 
 def get_supabase_client(service: bool = True) -> Client:
     """
-    Create and return a Supabase client instance.
+    Return a cached Supabase client instance, creating it on first use.
+    
+    The client (and its underlying HTTP connection pool) is shared across calls
+    so that each database operation does not pay for a new connection setup.
     
     Args:
         service: If True, use service_role_key (for admin operations).
@@ -114,99 +197,272 @@ def get_supabase_client(service: bool = True) -> Client:
     Returns:
         Supabase Client instance
     """
-    config = get_supabase_config()
-    url = config["url"]
-    key = config["service_role_key"] if service else os.getenv("SUPABASE_ANON_KEY", "")
+    client = _clients.get(service)
+    if client is not None:
+        return client
+    
+    with _clients_lock:
+        # Another thread may have created the client while we waited
+        client = _clients.get(service)
+        if client is not None:
+            return client
+        
+        config = get_supabase_config()
+        url = config["url"]
+        key = config["service_role_key"] if service else os.getenv("SUPABASE_ANON_KEY", "")
+        
+        if not key:
+            raise ValueError("Service role key or anon key is required")
+        
+        client = _create_pooled_client(url, key)
+        _clients[service] = client
+        logger.info("Successfully connected to Supabase")
+        return client
+
+
+def _create_pooled_client(url: str, key: str) -> Client:
+    """
+    Create a Supabase client backed by a bounded keep-alive connection pool.
+    
+    Keeping connections alive lets back-to-back queries reuse the same TCP/TLS
+    connection instead of paying a new handshake per request.
+    
+    Args:
+        url: Supabase project URL
+        key: Service role key or anon key
+    
+    Returns:
+        Supabase Client instance
+    """
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=SUPABASE_POOL_SIZE,
+            max_keepalive_connections=SUPABASE_POOL_SIZE,
+            keepalive_expiry=SUPABASE_POOL_RECYCLE
+        ),
+        timeout=httpx.Timeout(SUPABASE_REQUEST_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT),
+        http2=True,
+        follow_redirects=True
+    )
+    try:
+        options = ClientOptions(httpx_client=http_client)
+    except TypeError:
+        # Older supabase-py versions do not accept a custom httpx client
+        http_client.close()
+        logger.debug("supabase-py does not support httpx_client option, using default connection pool")
+        return create_client(url, key)
+    return create_client(url, key, options=options)
+
+
+def reset_supabase_client() -> None:
+    """
+    Drop cached Supabase clients so the next call creates fresh ones.
+    
+    Useful for tests or after changing Supabase environment variables.
+    """
+    with _clients_lock:
+        _clients.clear()
+    get_supabase_config.cache_clear()
+
+
+def _load_user_messages_rpc(client: Client, user_id: str) -> Optional[List[Dict]]:
+    """
+    Load user messages grouped by conversation via the
+    wb_user_conversations_with_user_messages RPC (see utils/functions.sql).
+    
+    The database performs the join and per-conversation aggregation, so the
+    whole result is fetched in a single round-trip.
+    
+    Args:
+        client: Supabase client
+        user_id: UUID of the user
+    
+    Returns:
+        List of conversation dictionaries (same format as load_user_messages),
+        or None if the RPC is unavailable (not installed, remembered per process) or fails.
+    """
+    global _messages_rpc_available
+    if not _messages_rpc_available:
+        return None
+    
+    try:
+        response = client.rpc(
+            'wb_user_conversations_with_user_messages',
+            {'uid': user_id}
+        ).execute()
+    except Exception as e:
+        if getattr(e, 'code', None) == _MISSING_FUNCTION_CODE:
+            _messages_rpc_available = False
+            logger.warning("wb_user_conversations_with_user_messages is not installed (see utils/functions.sql), "
+                           "using a joined table query from now on")
+        else:
+            logger.warning(f"wb_user_conversations_with_user_messages RPC failed, falling back to a joined table query: {e}")
+        return None
+    
+    result = []
+    for row in response.data or []:
+        result.append({
+            "user_id": user_id,
+            "conversation_id": row["conversation_id"],
+            "conversation_created_at": row["started_at"],
+            "total_messages": row["total_messages"],
+            "messages": row["messages"]
+        })
+    return result
+
+
+def _load_user_messages_joined(client: Client, user_id: str) -> List[Dict]:
+    """
+    Load user messages grouped by conversation with a single wb_message query
+    that inner-joins wb_conversation (filtered on the conversation's user_id).
+    
+    Rows are read in pages of MESSAGE_PAGE_SIZE (Supabase's default max-rows),
+    so most users need a single round-trip.
+    
+    Args:
+        client: Supabase client
+        user_id: UUID of the user
+    
+    Returns:
+        List of conversation dictionaries (same format as load_user_messages)
+    """
+    rows: List[Dict] = []
+    offset = 0
+    while True:
+        response = client.table("wb_message")\
+            .select("conversation_id, text, wb_conversation!inner(started_at)")\
+            .eq("wb_conversation.user_id", user_id)\
+            .eq("role", "user")\
+            .order("conversation_id")\
+            .order("created_at")\
+            .order("id")\
+            .range(offset, offset + MESSAGE_PAGE_SIZE - 1)\
+            .execute()
+        page = response.data or []
+        rows.extend(page)
+        if len(page) < MESSAGE_PAGE_SIZE:
+            break
+        offset += MESSAGE_PAGE_SIZE
     
-    if not key:
-        raise ValueError("Service role key or anon key is required")
+    # Rows arrive ordered by conversation, then created_at: bucket them per conversation.
+    # Response rows are reused as-is (minus the embedded conversation) instead of rebuilt.
+    result = []
+    # Per-conversation debug lines are only formatted when debug logging is on
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
+    for conv_id, conv_rows in groupby(rows, key=itemgetter("conversation_id")):
+        formatted_messages = list(conv_rows)
+        started_at = formatted_messages[0]["wb_conversation"]["started_at"]
+        for msg in formatted_messages:
+            del msg["wb_conversation"]
+        result.append({
+            "user_id": user_id,
+            "conversation_id": conv_id,
+            "conversation_created_at": started_at,
+            "total_messages": len(formatted_messages),
+            "messages": formatted_messages
+        })
+        if debug_enabled:
+            logger.debug(f"Conversation {conv_id}: {len(formatted_messages)} user messages")
     
-    client = create_client(url, key)
-    logger.info("Successfully connected to Supabase")
-    return client
+    # Conversations without user messages never appear; keep conversation start order
+    result.sort(key=itemgetter("conversation_created_at"))
+    return result
 
 
 def load_user_messages(user_id: str) -> List[Dict]:
     """
     Load all user messages from public.wb_message for a specific user, grouped by conversation.
     
+    Uses the wb_user_conversations_with_user_messages RPC when available (single
+    round-trip), otherwise falls back to one joined wb_message/wb_conversation query.
+    
     This function can be called by context_extractor.py to retrieve user messages.
     
     Args:
         user_id: UUID of the user
     
     Returns:
-        List of conversation dictionaries, each containing:
+        List of conversation dictionaries (ordered by conversation start), each containing:
         - user_id: UUID of the user
         - conversation_id: UUID of the conversation
         - conversation_created_at: Timestamp when conversation started
         - total_messages: Count of user messages in this conversation
         - messages: Array of user messages (filtered to role="user" only)
-          Each message contains: {"text": "..."}
+          Each message contains at least: {"text": "..."}
+        Conversations without user messages are omitted.
     """
     client = get_supabase_client()
     
-    # Get all conversations for this user with their metadata
-    conversations_response = client.table("wb_conversation")\
-        .select("id, started_at")\
-        .eq("user_id", user_id)\
-        .order("started_at", desc=False)\
-        .execute()
-    
-    conversations = conversations_response.data
+    result = _load_user_messages_rpc(client, user_id)
+    if result is None:
+        result = _load_user_messages_joined(client, user_id)
     
-    if not conversations:
-        logger.info(f"No conversations found for user {user_id}")
+    if not result:
+        logger.info(f"No conversations with user messages found for user {user_id}")
         return []
     
-    logger.info(f"Found {len(conversations)} conversations for user {user_id}")
-    
-    # Process each conversation
-    result = []
-    for conv in conversations:
-        conv_id = conv['id']
-        conv_started_at = conv['started_at']
-        
-        # Get all messages for this conversation (only user role)
-        messages_response = client.table("wb_message")\
-            .select("text")\
-            .eq("conversation_id", conv_id)\
-            .eq("role", "user")\
-            .order("created_at", desc=False)\
-            .execute()
-        
-        user_messages = messages_response.data
-        
-        # Format messages to only include text field
-        formatted_messages = [{"text": msg["text"]} for msg in user_messages]
-        
-        # Only include conversations that have user messages
-        if formatted_messages:
-            conversation_data = {
-                "user_id": user_id,
-                "conversation_id": conv_id,
-                "conversation_created_at": conv_started_at,
-                "total_messages": len(formatted_messages),
-                "messages": formatted_messages
-            }
-            result.append(conversation_data)
-            logger.debug(f"Conversation {conv_id}: {len(formatted_messages)} user messages")
-    
     total_user_messages = sum(conv['total_messages'] for conv in result)
     logger.info(f"Loaded {total_user_messages} user messages from {len(result)} conversations")
     return result
 
 
-def write_users_context_bundle(user_id: str, persona_summary: str = None, facts: str = None) -> bool:
+def get_users_context_bundle(user_id: str, columns: str = "*") -> Optional[Dict]:
+    """
+    Read a user's context bundle from the users_context_bundle table.
+    
+    Args:
+        user_id: UUID of the user
+        columns: Comma-separated columns to select (default: "*")
+    
+    Returns:
+        Dictionary with the selected columns, or None if not found or on error
+    """
+    try:
+        client = get_supabase_client()
+        
+        response = client.table("users_context_bundle")\
+            .select(columns)\
+            .eq("user_id", user_id)\
+            .maybe_single()\
+            .execute()
+        
+        if response is not None and response.data:
+            return response.data
+        return None
+    except Exception as e:
+        logger.warning(f"Failed to read context bundle for user {user_id}: {e}")
+        return None
+
+
+def write_users_context_bundle(
+    user_id: str,
+    persona_summary: str = None,
+    facts: str = None,
+    context_fingerprint: str = None,
+    facts_fingerprint: str = None,
+    facts_source_stamp: str = None
+) -> bool:
     """
     Write or update a user context bundle in the users_context_bundle table.
     This uses upsert (insert or update) since user_id is the primary key.
-    Supports partial updates - can update one or both fields.
+    Supports partial updates - can update one or more fields.
     
     Args:
         user_id: UUID of the user
         persona_summary: Optional persona summary text to save (daily life context)
         facts: Optional persona facts text to save
+        context_fingerprint: Optional fingerprint of the messages persona_summary was
+                             generated from (requires the context_fingerprint column,
+                             see utils/functions.sql)
+        facts_fingerprint: Optional fingerprint of the messages facts were generated
+                           from (requires the facts_fingerprint column, see
+                           utils/functions.sql)
+        facts_source_stamp: Optional stamp of the message embeddings version the facts
+                            were built from (requires the facts_source_stamp column,
+                            see utils/functions.sql)
+    
+    The fingerprint fields are dropped from the write (and from later writes) if the
+    columns do not exist yet, so the summaries themselves are still saved.
     
     Returns:
         True if write/update succeeded, False otherwise
@@ -226,18 +482,41 @@ def write_users_context_bundle(user_id: str, persona_summary: str = None, facts:
             payload["persona_summary"] = persona_summary
         if facts is not None:
             payload["facts"] = facts
+        if context_fingerprint is not None:
+            payload["context_fingerprint"] = context_fingerprint
+        if facts_fingerprint is not None:
+            payload["facts_fingerprint"] = facts_fingerprint
+        if facts_source_stamp is not None:
+            payload["facts_source_stamp"] = facts_source_stamp
+        
+        global _bundle_fingerprint_columns_available
+        if not _bundle_fingerprint_columns_available:
+            for column in _BUNDLE_FINGERPRINT_COLUMNS:
+                payload.pop(column, None)
         
         # Use upsert to insert or update (since user_id is primary key)
-        response = client.table("users_context_bundle")\
-            .upsert(payload, on_conflict="user_id")\
-            .execute()
-        
-        if response.data:
-            logger.info(f"Successfully wrote/updated context bundle for user {user_id}")
-            return True
-        else:
-            logger.warning(f"No data returned for context bundle update for user {user_id}")
-            return False
+        # returning=minimal skips reading the written row back; execute() raises on failure
+        try:
+            client.table("users_context_bundle")\
+                .upsert(payload, on_conflict="user_id", returning=ReturnMethod.minimal)\
+                .execute()
+        except Exception as e:
+            if getattr(e, 'code', None) != _MISSING_COLUMN_CODE or \
+                    not any(column in payload for column in _BUNDLE_FINGERPRINT_COLUMNS):
+                raise
+            
+            # Migration not applied yet: save the summaries without their fingerprints
+            _bundle_fingerprint_columns_available = False
+            logger.warning("users_context_bundle has no fingerprint columns (see utils/functions.sql), "
+                           "saving context bundles without them from now on")
+            for column in _BUNDLE_FINGERPRINT_COLUMNS:
+                payload.pop(column, None)
+            client.table("users_context_bundle")\
+                .upsert(payload, on_conflict="user_id", returning=ReturnMethod.minimal)\
+                .execute()
+        
+        logger.info(f"Successfully wrote/updated context bundle for user {user_id}")
+        return True
     except Exception as e:
         logger.error(f"Failed to write context bundle for user {user_id}: {e}")
         return False
@@ -482,10 +761,10 @@ def fetch_user_preferences(user_id: str) -> Dict:
         response = client.table("users")\
             .select("prefer_intervention")\
             .eq("id", user_id)\
-            .single()\
+            .maybe_single()\
             .execute()
         
-        if response.data and "prefer_intervention" in response.data:
+        if response is not None and response.data and "prefer_intervention" in response.data:
             preferences = response.data["prefer_intervention"]
             logger.info(f"Fetched preferences for user {user_id}: {preferences}")
             return preferences
@@ -523,29 +802,109 @@ def get_user_language(user_id: str) -> str:
     Args:
         user_id: UUID of the user
     
+    Successful lookups are cached for USER_LANGUAGE_CACHE_TTL seconds; call
+    clear_user_language_cache() after the user's preference changes.
+    
     Returns:
         Language code string (e.g., "en", "zh", "ms")
         Returns "en" (English) as default if user not found or language missing.
     """
+    cached = _user_language_cache.get(user_id)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    
     try:
         client = get_supabase_client()
         
         response = client.table("users")\
             .select("language")\
             .eq("id", user_id)\
-            .single()\
+            .maybe_single()\
             .execute()
         
-        if response.data and "language" in response.data:
+        if response is not None and response.data and "language" in response.data:
             language = response.data["language"]
             logger.info(f"Fetched language for user {user_id}: {language}")
-            return language
         else:
             logger.warning(f"No language found for user {user_id}, using default 'en'")
-            return "en"
+            language = "en"
     except Exception as e:
         logger.error(f"Failed to fetch language for user {user_id}: {e}")
-        return "en"  # Default to English on error
+        return "en"  # Default to English on error (not cached)
+    
+    with _user_language_cache_lock:
+        if len(_user_language_cache) >= USER_LANGUAGE_CACHE_SIZE:
+            _user_language_cache.clear()
+        _user_language_cache[user_id] = (language, time.monotonic() + USER_LANGUAGE_CACHE_TTL)
+    return language
+
+
+def clear_user_language_cache(user_id: Optional[str] = None) -> None:
+    """
+    Drop cached preferred languages.
+    
+    Args:
+        user_id: UUID of the user to invalidate; if None, clears the whole cache
+    """
+    with _user_language_cache_lock:
+        if user_id is None:
+            _user_language_cache.clear()
+        else:
+            _user_language_cache.pop(user_id, None)
+
+
+def get_user_language_name(user_id: str) -> str:
+    """
+    Get the user's preferred output language name (e.g., "English") for LLM prompts.
+    
+    Args:
+        user_id: UUID of the user
+    
+    Returns:
+        Language name ("English", "Chinese" or "Malay"), defaults to "English"
+    """
+    # Fetch user's preferred language from database (instead of detecting from messages)
+    language_code = get_user_language(user_id)
+    return _LANGUAGE_NAMES.get(language_code, "English")  # Default to English if unknown code
+
+
+def get_embeddings_version(user_id: str, model_tag: str = 'e5', kind: str = 'message') -> Optional[str]:
+    """
+    Get a version string for the user's embeddings of a given kind and model.
+    
+    The version is the newest updated_at plus the row count, so it changes whenever an
+    embedding is inserted, re-embedded (upsert) or deleted. Requires the updated_at
+    column and trigger from utils/functions.sql.
+    
+    Args:
+        user_id: UUID of the user
+        model_tag: Model tag ('miniLM' or 'e5'), default 'e5'
+        kind: Embedding kind, default 'message'
+    
+    Returns:
+        Version string "<newest updated_at>|<count>", or None if the user has no such
+        embeddings or on error (e.g. the migration has not been applied)
+    """
+    try:
+        client = get_supabase_client()
+        
+        # One request: the newest row plus the exact count of matching rows
+        response = client.table("wb_embeddings")\
+            .select("updated_at", count=CountMethod.exact)\
+            .eq("user_id", user_id)\
+            .eq("kind", kind)\
+            .eq("model_tag", model_tag)\
+            .order("updated_at", desc=True)\
+            .limit(1)\
+            .execute()
+        
+        if response.data:
+            return f"{response.data[0]['updated_at']}|{response.count}"
+        return None
+        
+    except Exception as e:
+        logger.warning(f"Failed to get embeddings version for user {user_id}: {e}")
+        return None
 
 
 def check_embedding_exists(ref_id: str, model_tag: str) -> bool:
@@ -578,6 +937,54 @@ def check_embedding_exists(ref_id: str, model_tag: str) -> bool:
         return False
 
 
+def existing_embedding_ref_ids(ref_ids: List[str], model_tag: str) -> Set[str]:
+    """
+    Return the subset of ref_ids that already have an embedding for model_tag.
+    Bulk counterpart of check_embedding_exists (one query per
+    MESSAGE_FETCH_BATCH_SIZE ref_ids instead of one per ref_id).
+    
+    Args:
+        ref_ids: Reference IDs (message IDs or chunk IDs) to check
+        model_tag: Model tag ('miniLM' or 'e5')
+    
+    Returns:
+        Set of ref_ids that already have an embedding (empty set on error)
+    """
+    existing: Set[str] = set()
+    if not ref_ids:
+        return existing
+    
+    try:
+        client = get_supabase_client()
+        
+        for i in range(0, len(ref_ids), MESSAGE_FETCH_BATCH_SIZE):
+            batch_ids = ref_ids[i:i + MESSAGE_FETCH_BATCH_SIZE]
+            response = client.table("wb_embeddings")\
+                .select("ref_id")\
+                .in_("ref_id", batch_ids)\
+                .eq("model_tag", model_tag)\
+                .execute()
+            existing.update(row["ref_id"] for row in response.data)
+        
+        return existing
+        
+    except Exception as e:
+        logger.error(f"Failed to check embedding existence for {len(ref_ids)} ref_ids, model_tag {model_tag}: {e}")
+        return set()
+
+
+def _format_vector(vector: List[float]) -> str:
+    """
+    Convert an embedding vector to pgvector format (string representation).
+    Supabase pgvector expects format: "[0.1,0.2,...]"
+    
+    Components are written with VECTOR_SIGNIFICANT_DIGITS significant digits:
+    pgvector stores float4, which round-trips exactly through 9 digits, so the
+    extra digits of a float64 repr only add request payload.
+    """
+    return "[" + ",".join([_VECTOR_COMPONENT_FORMAT % v for v in vector]) + "]"
+
+
 def store_embedding(
     user_id: str,
     kind: str,
@@ -601,34 +1008,101 @@ def store_embedding(
     try:
         client = get_supabase_client()
         
-        # Convert vector to pgvector format (string representation)
-        # Supabase pgvector expects format: "[0.1,0.2,...]"
-        vector_str = "[" + ",".join(str(v) for v in vector) + "]"
-        
         payload = {
             "user_id": user_id,
             "kind": kind,
             "ref_id": ref_id,
-            "vector": vector_str,
+            "vector": _format_vector(vector),
             "model_tag": model_tag
         }
         
-        response = client.table("wb_embeddings")\
-            .insert(payload)\
+        # returning=minimal skips reading the written row back; execute() raises on failure
+        client.table("wb_embeddings")\
+            .insert(payload, returning=ReturnMethod.minimal)\
             .execute()
         
-        if response.data:
-            logger.debug(f"Successfully stored embedding for ref_id {ref_id}, model_tag {model_tag}")
-            return True
-        else:
-            logger.warning(f"No data returned for embedding storage for ref_id {ref_id}")
-            return False
+        logger.debug(f"Successfully stored embedding for ref_id {ref_id}, model_tag {model_tag}")
+        return True
             
     except Exception as e:
         logger.error(f"Failed to store embedding for ref_id {ref_id}, model_tag {model_tag}: {e}")
         return False
 
 
+def store_embeddings(
+    user_id: str,
+    kind: str,
+    embeddings: List[Tuple[str, List[float]]],
+    model_tag: str
+) -> int:
+    """
+    Store multiple embedding vectors in the wb_embeddings table using bulk upserts.
+    
+    Rows are sent in batches of EMBEDDING_UPSERT_BATCH_SIZE, each batch as a single
+    multi-row upsert on (ref_id, model_tag) (one round-trip per batch instead of one
+    per embedding; re-storing an existing ref_id replaces its vector).
+    
+    The upsert needs the wb_embeddings_ref_id_model_tag_key constraint (see
+    utils/functions.sql); without it, batches are stored with plain inserts.
+    
+    Args:
+        user_id: UUID of the user
+        kind: Type of embedding ('message', 'journal', 'todo', 'preference', 'gratitude')
+        embeddings: List of (ref_id, vector) tuples
+        model_tag: Model tag ('miniLM' or 'e5')
+    
+    Returns:
+        Number of embeddings stored (0 if nothing was stored)
+    """
+    if not embeddings:
+        return 0
+    
+    payloads = [
+        {
+            "user_id": user_id,
+            "kind": kind,
+            "ref_id": ref_id,
+            "vector": _format_vector(vector),
+            "model_tag": model_tag
+        }
+        for ref_id, vector in embeddings
+    ]
+    
+    global _embedding_upsert_available
+    
+    stored = 0
+    try:
+        client = get_supabase_client()
+        
+        for i in range(0, len(payloads), EMBEDDING_UPSERT_BATCH_SIZE):
+            batch = payloads[i:i + EMBEDDING_UPSERT_BATCH_SIZE]
+            # returning=minimal skips reading the written rows back; execute() raises on failure
+            if _embedding_upsert_available:
+                try:
+                    client.table("wb_embeddings")\
+                        .upsert(batch, on_conflict="ref_id,model_tag", returning=ReturnMethod.minimal)\
+                        .execute()
+                except Exception as e:
+                    if getattr(e, 'code', None) != _NO_CONFLICT_TARGET_CODE:
+                        raise
+                    # Migration not applied yet: fall back to inserts (this batch included)
+                    _embedding_upsert_available = False
+                    logger.warning("wb_embeddings has no (ref_id, model_tag) unique constraint "
+                                   "(see utils/functions.sql), storing embeddings with inserts from now on")
+            if not _embedding_upsert_available:
+                client.table("wb_embeddings")\
+                    .insert(batch, returning=ReturnMethod.minimal)\
+                    .execute()
+            stored += len(batch)
+        
+        logger.debug(f"Stored {stored}/{len(payloads)} embeddings for user {user_id}, model_tag {model_tag}")
+        return stored
+        
+    except Exception as e:
+        logger.error(f"Failed to bulk store embeddings for user {user_id}, model_tag {model_tag}: {e}")
+        return stored
+
+
 def get_conversation_user_id(conversation_id: str) -> str:
     """
     Get the user_id for a given conversation_id.
@@ -645,16 +1119,18 @@ def get_conversation_user_id(conversation_id: str) -> str:
     try:
         client = get_supabase_client()
         
+        # Primary-key lookup: request a single object instead of an array
         response = client.table("wb_conversation")\
             .select("user_id")\
             .eq("id", conversation_id)\
-            .limit(1)\
+            .maybe_single()\
             .execute()
         
-        if not response.data:
+        # maybe_single() yields no response/data when the row does not exist
+        if response is None or not response.data:
             raise ValueError(f"Conversation {conversation_id} not found")
         
-        user_id = response.data[0].get("user_id")
+        user_id = response.data.get("user_id")
         logger.info(f"Conversation {conversation_id} belongs to user {user_id}")
         return user_id
         
@@ -665,7 +1141,11 @@ def get_conversation_user_id(conversation_id: str) -> str:
         raise ValueError(f"Failed to get user_id for conversation {conversation_id}: {e}")
 
 
-def load_conversation_messages(conversation_id: str, user_id: str = None) -> List[Dict]:
+def load_conversation_messages(
+    conversation_id: str,
+    user_id: str = None,
+    columns: str = "id, text, created_at, role"
+) -> List[Dict]:
     """
     Load all user messages for a specific conversation.
     
@@ -674,9 +1154,13 @@ def load_conversation_messages(conversation_id: str, user_id: str = None) -> Lis
         user_id: Optional user_id to validate conversation ownership.
                  If provided, will raise ValueError if conversation doesn't belong to this user.
                  If None, will fetch user_id from conversation.
+        columns: Comma-separated wb_message columns to select
+                 (default: "id, text, created_at, role"). Pass a narrower projection
+                 from hot paths to reduce payload size.
     
     Returns:
-        List of message dictionaries, each containing:
+        List of message dictionaries, each containing the selected columns
+        (by default):
         - id: Message UUID
         - text: Message text
         - created_at: Timestamp
@@ -699,7 +1183,7 @@ def load_conversation_messages(conversation_id: str, user_id: str = None) -> Lis
                 )
         
         response = client.table("wb_message")\
-            .select("id, text, created_at, role")\
+            .select(columns)\
             .eq("conversation_id", conversation_id)\
             .eq("role", "user")\
             .order("created_at", desc=False)\
@@ -761,13 +1245,6 @@ def get_activity_counts(user_id: str, days: int = 30) -> Dict[str, int]:
         # Calculate cutoff time (days ago from now) in UTC+8
         cutoff_time = get_current_time_utc8() - timedelta(days=days)
         
-        # Query intervention_log table for last N days
-        response = client.table("intervention_log")\
-            .select("intervention_type")\
-            .eq("user_id", user_id)\
-            .gte("timestamp", cutoff_time.isoformat())\
-            .execute()
-        
         # Initialize counts for all activity types
         activity_counts = {
             'journal': 0,
@@ -776,6 +1253,15 @@ def get_activity_counts(user_id: str, days: int = 30) -> Dict[str, int]:
             'quote': 0
         }
         
+        # Query intervention_log table for last N days
+        # (only rows for tracked activity types are returned)
+        response = client.table("intervention_log")\
+            .select("intervention_type")\
+            .eq("user_id", user_id)\
+            .in_("intervention_type", list(activity_counts.keys()))\
+            .gte("timestamp", cutoff_time.isoformat())\
+            .execute()
+        
         # Count occurrences of each activity type
         if response.data:
             for log in response.data:
@@ -847,8 +1333,9 @@ def query_voice_emotion_signals(
             return SER_TO_FUSION_EMOTION_MAP.get(ser_emotion.lower())
         
         # Query database
+        # Only project the columns used below (voice_emotion rows carry large feature arrays)
         query = client.table("voice_emotion")\
-            .select("*")\
+            .select("timestamp, predicted_emotion, emotion_confidence")\
             .eq("user_id", user_id)\
             .gte("timestamp", start_time_str)\
             .lte("timestamp", end_time_str)\
@@ -928,8 +1415,9 @@ def query_face_emotion_signals(
         
         # Query database
         query = client.table("face_emotion")\
-            .select("*")\
+            .select("timestamp, predicted_emotion, emotion_confidence")\
             .eq("user_id", user_id)\
+            .in_("predicted_emotion", VALID_EMOTION_LABELS)\
             .gte("timestamp", start_time_str)\
             .lte("timestamp", end_time_str)\
             .order("timestamp", desc=False)
@@ -937,14 +1425,15 @@ def query_face_emotion_signals(
         response = query.execute()
         
         signals = []
+        append_signal = signals.append
+        valid_labels = _VALID_EMOTION_LABEL_SET
         for record in response.data:
             # face_emotion uses predicted_emotion and emotion_confidence columns
             emotion_label = record.get("predicted_emotion", "")
             confidence = float(record.get("emotion_confidence", 0.0))
             
-            # Validate emotion label (should be one of: Angry, Sad, Happy, Fear)
-            valid_emotions = ["Angry", "Sad", "Happy", "Fear"]
-            if emotion_label not in valid_emotions:
+            # Labels are filtered server-side; keep a defensive check
+            if emotion_label not in valid_labels:
                 logger.debug(f"Skipping invalid emotion: {emotion_label}")
                 continue
             
@@ -956,7 +1445,7 @@ def query_face_emotion_signals(
                 "emotion_label": emotion_label,
                 "confidence": confidence
             }
-            signals.append(signal)
+            append_signal(signal)
         
         logger.info(
             f"Queried {len(signals)} face emotion signals for user {user_id} "
@@ -1009,12 +1498,12 @@ def query_vitals_emotion_signals(
         start_time_str = start_time.isoformat()
         end_time_str = end_time.isoformat()
         
-        # Query bvs_emotion table for records with emotion predictions
-        # Note: timestamp and predicted_emotion columns exist, but emotion_confidence needs to be added
+        # Query bvs_emotion table for records with valid emotion predictions
+        # Only project the columns used below (see utils/schemas.sql for the bvs_emotion schema)
         query = client.table("bvs_emotion")\
-            .select("*")\
+            .select("timestamp, date, predicted_emotion, emotion_confidence")\
             .eq("user_id", user_id)\
-            .not_.is_("predicted_emotion", "null")\
+            .in_("predicted_emotion", VALID_EMOTION_LABELS)\
             .gte("timestamp", start_time_str)\
             .lte("timestamp", end_time_str)\
             .order("timestamp", desc=False)
@@ -1022,15 +1511,16 @@ def query_vitals_emotion_signals(
         response = query.execute()
         
         signals = []
+        append_signal = signals.append
+        valid_labels = _VALID_EMOTION_LABEL_SET
         for record in response.data:
             emotion_label = record.get("predicted_emotion", "")
             # emotion_confidence column may not exist yet, default to 0.0 if missing
             confidence_value = record.get("emotion_confidence")
             confidence = float(confidence_value) if confidence_value is not None else 0.0
             
-            # Validate emotion label
-            valid_emotions = ["Angry", "Sad", "Happy", "Fear"]
-            if emotion_label not in valid_emotions:
+            # Labels are filtered server-side; keep a defensive check
+            if emotion_label not in valid_labels:
                 logger.debug(f"Skipping invalid emotion: {emotion_label}")
                 continue
             
@@ -1050,7 +1540,7 @@ def query_vitals_emotion_signals(
                 "emotion_label": emotion_label,
                 "confidence": confidence
             }
-            signals.append(signal)
+            append_signal(signal)
         
         logger.info(
             f"Queried {len(signals)} vitals emotion signals for user {user_id} "
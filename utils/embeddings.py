@@ -146,6 +146,56 @@ def generate_query_embedding(text: str, model_tag: str = 'e5') -> List[float]:
         raise
 
 
+def generate_query_embeddings_batch(texts: List[str], model_tag: str = 'e5') -> List[List[float]]:
+    """
+    Generate embeddings for several query texts in a single model call.
+    
+    For E5 models, uses "query: " prefix (same as generate_query_embedding).
+    
+    Args:
+        texts: List of query text strings to embed
+        model_tag: Model identifier ('miniLM' or 'e5'), default 'e5'
+    
+    Returns:
+        List of embedding vectors (each is a list of floats), in the same order as texts
+    
+    Raises:
+        ValueError: If model_tag is invalid, texts is empty or contains empty strings
+        ImportError: If sentence-transformers is not installed
+    """
+    if not texts:
+        raise ValueError("Texts list cannot be empty")
+    if any(not text or not text.strip() for text in texts):
+        raise ValueError("Text cannot be empty")
+    
+    # Load model (cached after first load)
+    model = _load_model(model_tag)
+    
+    # For E5 models, prepend "query: " prefix (different from "passage: " for storage)
+    if model_tag == 'e5':
+        prefixed_texts = [f"query: {text}" for text in texts]
+    else:
+        prefixed_texts = texts
+    
+    # Generate embeddings
+    try:
+        embeddings = model.encode(
+            prefixed_texts,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        
+        # Convert numpy arrays to lists
+        if isinstance(embeddings, np.ndarray):
+            embeddings = embeddings.tolist()
+        
+        return embeddings
+        
+    except Exception as e:
+        logger.error(f"Failed to generate batch query embeddings: {e}")
+        raise
+
+
 def generate_embeddings_batch(texts: List[str], model_tag: str = 'e5', batch_size: int = 32) -> List[List[float]]:
     """
     Generate embeddings for a batch of texts (more efficient than individual calls).
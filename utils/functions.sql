@@ -0,0 +1,125 @@
+-- Database functions and schema additions used by the CMS service
+-- Run this in the Supabase SQL editor to create/update them
+
+-- Returns a user's conversations with their user-role messages aggregated per conversation.
+-- Used by utils/database.py load_user_messages() to fetch everything in one round-trip.
+CREATE OR REPLACE FUNCTION public.wb_user_conversations_with_user_messages(uid uuid)
+RETURNS TABLE (
+    conversation_id uuid,
+    started_at timestamp with time zone,
+    messages jsonb,
+    total_messages bigint
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        c.id AS conversation_id,
+        c.started_at,
+        jsonb_agg(jsonb_build_object('text', m.text) ORDER BY m.created_at) AS messages,
+        count(*) AS total_messages
+    FROM public.wb_conversation c
+    JOIN public.wb_message m ON m.conversation_id = c.id
+    WHERE c.user_id = uid
+      AND m.role = 'user'
+    GROUP BY c.id, c.started_at
+    ORDER BY c.started_at;
+$$;
+
+-- Fingerprint of the messages the daily life context (persona_summary) was generated from.
+-- Used by context_generator/context_extractor.py to skip the LLM call when nothing changed.
+ALTER TABLE public.users_context_bundle
+    ADD COLUMN IF NOT EXISTS context_fingerprint text;
+
+-- Fingerprint of the message ids the persona facts were generated from.
+-- Used by context_generator/facts_extractor.py to skip the LLM call when nothing changed.
+ALTER TABLE public.users_context_bundle
+    ADD COLUMN IF NOT EXISTS facts_fingerprint text;
+
+-- Output language, model tag and message embeddings version (newest updated_at plus
+-- row count) at the time the persona facts were built. Lets facts_extractor.py return the
+-- stored facts without a vector search when no embeddings were added, changed or removed since.
+ALTER TABLE public.users_context_bundle
+    ADD COLUMN IF NOT EXISTS facts_source_stamp text;
+
+-- Last write time of each embedding row. Upserts on (ref_id, model_tag) keep created_at,
+-- so the facts source stamp (database.get_embeddings_version) reads updated_at instead.
+ALTER TABLE public.wb_embeddings
+    ADD COLUMN IF NOT EXISTS updated_at timestamp with time zone NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION public.wb_embeddings_set_updated_at()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS wb_embeddings_set_updated_at ON public.wb_embeddings;
+CREATE TRIGGER wb_embeddings_set_updated_at
+    BEFORE UPDATE ON public.wb_embeddings
+    FOR EACH ROW EXECUTE FUNCTION public.wb_embeddings_set_updated_at();
+
+-- Serves the embeddings version lookup (database.get_embeddings_version)
+DROP INDEX IF EXISTS public.wb_embeddings_user_kind_model_created_idx;
+CREATE INDEX IF NOT EXISTS wb_embeddings_user_kind_model_updated_idx
+    ON public.wb_embeddings (user_id, kind, model_tag, updated_at DESC);
+
+-- One embedding per (ref_id, model_tag): lets database.store_embeddings() upsert rows in bulk
+-- with on_conflict=ref_id,model_tag. Older duplicates are removed first (newest row is kept).
+DELETE FROM public.wb_embeddings a
+    USING public.wb_embeddings b
+    WHERE a.ref_id = b.ref_id
+      AND a.model_tag = b.model_tag
+      AND (a.created_at, a.id) < (b.created_at, b.id);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'wb_embeddings_ref_id_model_tag_key'
+    ) THEN
+        ALTER TABLE public.wb_embeddings
+            ADD CONSTRAINT wb_embeddings_ref_id_model_tag_key UNIQUE (ref_id, model_tag);
+    END IF;
+END $$;
+
+-- Runs match_embeddings for several query vectors and returns each ref_id once
+-- (with its best similarity). query_vectors is a JSON array of vectors.
+-- Used by utils/vector_search.py search_similar_embeddings_multi() so the
+-- focus-area searches of the context/facts extractors take a single round-trip.
+CREATE OR REPLACE FUNCTION public.match_embeddings_multi(
+    query_vectors jsonb,
+    match_user_id uuid,
+    match_model_tag text,
+    match_kind text,
+    match_threshold double precision,
+    index_limit integer DEFAULT 100
+)
+RETURNS TABLE (
+    ref_id uuid,
+    similarity double precision,
+    kind text,
+    created_at timestamp with time zone
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT DISTINCT ON (m.ref_id)
+        m.ref_id,
+        m.similarity,
+        m.kind,
+        m.created_at
+    FROM jsonb_array_elements_text(query_vectors) AS q(vec)
+    CROSS JOIN LATERAL public.match_embeddings(
+        query_vector => q.vec::vector,
+        match_user_id => match_user_id,
+        match_model_tag => match_model_tag,
+        match_kind => match_kind,
+        match_threshold => match_threshold,
+        match_limit => NULL,
+        index_limit => index_limit
+    ) AS m
+    ORDER BY m.ref_id, m.similarity DESC;
+$$;
@@ -0,0 +1,35 @@
+"""
+JSON I/O Script
+
+This script provides the JSON parser shared by the services (orjson when available)
+and a helper that loads a JSON file with a single open.
+"""
+
+import json
+from typing import Any
+
+# Use orjson when available (faster C decoder; its decode error subclasses
+# json.JSONDecodeError, so callers only need to handle the standard exception)
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+
+def load_json_file(path: str) -> Any:
+    """
+    Read and parse a JSON file (a single open instead of an exists() check first).
+
+    Args:
+        path: Path to the JSON file
+
+    Returns:
+        Parsed JSON value
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+        json.JSONDecodeError: If the file is not valid JSON
+    """
+    with open(path, 'rb') as f:
+        return json_loads(f.read())
@@ -1,9 +1,28 @@
-import json
+import os
+import logging
+import threading
+import time
+from functools import lru_cache
 import httpx
-from typing import Dict, Iterable, Generator, List, Optional
+from typing import Dict, Iterable, Generator, List, Optional, Tuple
+from utils.bootstrap import ensure_loaded
+# orjson when available, for parsing streamed chunks
+from utils.json_io import json_loads as _json_loads
+
+logger = logging.getLogger(__name__)
+
+# Retries for chat() after a timeout, transport error or retryable HTTP status
+# (a hung reasoner call is cut off by its per-attempt timeout and retried once by default)
+CHAT_MAX_RETRIES = int(os.getenv("DEEPSEEK_MAX_RETRIES", "1"))
+CHAT_RETRY_BACKOFF_SECONDS = 2.0
+_RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# Read timeout of the first deepseek-reasoner attempt; later attempts grow up to the
+# client timeout, so a hung call is retried early while slow answers still finish
+REASONER_FIRST_ATTEMPT_TIMEOUT = float(os.getenv("DEEPSEEK_REASONER_FIRST_ATTEMPT_TIMEOUT", "60"))
 
 class DeepSeekClient:
-    def __init__(self, api_key: str, base_url: str = "https://api.deepseek.com", model: str = "deepseek-reasoner", timeout: float = 680.0):
+    def __init__(self, api_key: str, base_url: str = "https://api.deepseek.com", model: str = "deepseek-reasoner", timeout: float = 680.0, max_retries: int = CHAT_MAX_RETRIES):
         """
         Initialize DeepSeek client.
         
@@ -12,12 +31,45 @@ class DeepSeekClient:
             base_url: Base URL for API (default: https://api.deepseek.com)
             model: Model name (default: deepseek-reasoner)
             timeout: Timeout in seconds (default: 180.0 for reasoning models)
+            max_retries: Retries for chat() on timeouts and transient errors (default: CHAT_MAX_RETRIES)
+        
+        The last chat() attempt always gets the full `timeout`; earlier attempts may
+        get shorter ones (see _attempt_timeouts).
         """
         self.api_key = api_key
         self.base_url = base_url.rstrip("/")
         self.model = model
         # Use longer timeout for reasoning models (they need time to generate reasoning chain)
         self.timeout = timeout
+        self.max_retries = max_retries
+        # Persistent HTTP client so repeated chat() calls reuse the pooled TLS connection
+        self._http: Optional[httpx.Client] = None
+        self._http_lock = threading.Lock()
+
+    def _get_http(self) -> httpx.Client:
+        """Lazily create the shared httpx.Client used by chat()."""
+        if self._http is None:
+            with self._http_lock:
+                if self._http is None:
+                    # Use a Timeout object with separate connect and read timeouts
+                    # Reasoning models can take a long time, so we use a generous read timeout
+                    timeout_config = httpx.Timeout(
+                        connect=10.0,  # 10 seconds to establish connection
+                        read=self.timeout,  # Use the full timeout for reading the response
+                        write=10.0,  # 10 seconds to write the request
+                        pool=10.0  # 10 seconds to get a connection from pool
+                    )
+                    # HTTP/2 (httpx[http2] is in requirements) multiplexes concurrent
+                    # requests from the extractors over one kept-alive TLS connection
+                    self._http = httpx.Client(timeout=timeout_config, http2=True)
+        return self._http
+
+    def close(self) -> None:
+        """Close the underlying HTTP client (a new one is created on the next call)."""
+        with self._http_lock:
+            if self._http is not None:
+                self._http.close()
+                self._http = None
 
     def _headers(self) -> Dict[str, str]:
         return {
@@ -38,13 +90,7 @@ class DeepSeekClient:
             payload.update(kwargs)
 
         url = f"{self.base_url}/v1/chat/completions"
-        timeout_config = httpx.Timeout(
-            connect=10.0,
-            read=self.timeout,
-            write=10.0,
-            pool=10.0
-        )
-        with httpx.stream("POST", url, headers=self._headers(), json=payload, timeout=timeout_config) as r:
+        with self._get_http().stream("POST", url, headers=self._headers(), json=payload) as r:
             r.raise_for_status()
             for line in r.iter_lines():
                 if not line:
@@ -57,7 +103,7 @@ class DeepSeekClient:
                 if data == "[DONE]":
                     break
                 try:
-                    obj = json.loads(data)
+                    obj = _json_loads(data)
                     delta = obj.get("choices", [{}])[0].get("delta", {})
                     chunk = delta.get("content")
                     if chunk:
@@ -66,10 +112,39 @@ class DeepSeekClient:
                     # swallow malformed SSE fragments
                     continue
 
-    def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+    def _attempt_timeouts(self, request_timeout: Optional[float] = None) -> List[float]:
+        """
+        Read timeout for each chat() attempt.
+        
+        Timeouts grow linearly from request_timeout to self.timeout, so the last attempt
+        always gets the full client timeout. Without a request_timeout every attempt gets
+        self.timeout; deepseek-reasoner defaults to REASONER_FIRST_ATTEMPT_TIMEOUT.
+        
+        Args:
+            request_timeout: Read timeout of the first attempt
+        
+        Returns:
+            List of read timeouts in seconds, one per attempt
+        """
+        attempts = self.max_retries + 1
+        if request_timeout is None and self.model == "deepseek-reasoner":
+            request_timeout = REASONER_FIRST_ATTEMPT_TIMEOUT
+        if request_timeout is None or attempts == 1 or request_timeout >= self.timeout:
+            return [self.timeout] * attempts
+        
+        step = (self.timeout - request_timeout) / (attempts - 1)
+        return [request_timeout + step * attempt for attempt in range(attempts)]
+
+    def chat(self, messages: List[Dict[str, str]], request_timeout: Optional[float] = None, **kwargs) -> str:
         """
         Non-streaming chat completion. Supports reasoning models like deepseek-reasoner.
         For reasoning models, returns the final content (not reasoning_content).
+        
+        Args:
+            messages: Chat messages
+            request_timeout: Read timeout of the first attempt; retries grow up to the
+                             client timeout (see _attempt_timeouts)
+            **kwargs: Extra request payload fields
         """
         payload = {
             "model": self.model,
@@ -79,19 +154,100 @@ class DeepSeekClient:
             payload.update(kwargs)
 
         url = f"{self.base_url}/v1/chat/completions"
-        # Use a Timeout object with separate connect and read timeouts
-        # Reasoning models can take a long time, so we use a generous read timeout
-        timeout_config = httpx.Timeout(
-            connect=10.0,  # 10 seconds to establish connection
-            read=self.timeout,  # Use the full timeout for reading the response
-            write=10.0,  # 10 seconds to write the request
-            pool=10.0  # 10 seconds to get a connection from pool
-        )
-        with httpx.Client(timeout=timeout_config) as client:
-            resp = client.post(url, headers=self._headers(), json=payload)
-            resp.raise_for_status()
-            data = resp.json()
-            message = data["choices"][0]["message"]
-            # For reasoning models, extract content (final answer)
-            # reasoning_content is also available but not returned
-            return message.get("content", "")
+        for attempt, attempt_timeout in enumerate(self._attempt_timeouts(request_timeout)):
+            start = time.perf_counter()
+            try:
+                resp = self._get_http().post(
+                    url,
+                    headers=self._headers(),
+                    json=payload,
+                    timeout=httpx.Timeout(connect=10.0, read=attempt_timeout, write=10.0, pool=10.0)
+                )
+                resp.raise_for_status()
+                break
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                elapsed = time.perf_counter() - start
+                retryable = not isinstance(e, httpx.HTTPStatusError) or \
+                    e.response.status_code in _RETRYABLE_STATUS_CODES
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                logger.warning(f"{self.model} request failed after {elapsed:.1f}s "
+                               f"(attempt {attempt + 1}/{self.max_retries + 1}, "
+                               f"timeout {attempt_timeout:.0f}s): {e!r}; retrying")
+                time.sleep(CHAT_RETRY_BACKOFF_SECONDS * (attempt + 1))
+        logger.info(f"{self.model} responded in {time.perf_counter() - start:.1f}s")
+        data = resp.json()
+        message = data["choices"][0]["message"]
+        # For reasoning models, extract content (final answer)
+        # reasoning_content is also available but not returned
+        return message.get("content", "")
+
+
+@lru_cache(maxsize=1)
+def get_deepseek_api_key() -> str:
+    """
+    Get the DeepSeek API key from the environment (.env is loaded first).
+    
+    The result is cached per process; call get_deepseek_api_key.cache_clear()
+    (or reset_deepseek_clients()) after rotating the key.
+    
+    Returns:
+        DeepSeek API key
+    
+    Raises:
+        ValueError: If DEEPSEEK_API_KEY is not set
+    """
+    ensure_loaded()
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    if not api_key:
+        raise ValueError("DEEPSEEK_API_KEY environment variable is required")
+    return api_key
+
+
+# Cached clients keyed by (model, timeout), shared across calls so the HTTP
+# connection pool and TLS session are reused
+_clients: Dict[Tuple[str, float], DeepSeekClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_deepseek_client(model: str, timeout: float) -> DeepSeekClient:
+    """
+    Get a cached DeepSeek client for the given model and timeout.
+    
+    The API key comes from get_deepseek_api_key() when the client is first created;
+    call reset_deepseek_clients() after rotating the key.
+    
+    Args:
+        model: Model name (e.g., 'deepseek-reasoner')
+        timeout: Read timeout in seconds
+    
+    Returns:
+        Shared DeepSeekClient instance
+    
+    Raises:
+        ValueError: If API key is missing
+    """
+    key = (model, timeout)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            api_key = get_deepseek_api_key()
+            logger.info(f"Initializing DeepSeek client ({model})")
+            client = DeepSeekClient(api_key=api_key, model=model, timeout=timeout)
+            _clients[key] = client
+    return client
+
+
+def reset_deepseek_clients() -> None:
+    """
+    Close and drop all cached DeepSeek clients (e.g., after rotating DEEPSEEK_API_KEY).
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+    get_deepseek_api_key.cache_clear()
@@ -124,6 +124,9 @@ CREATE TABLE public.users_context_bundle (
   persona_summary text,
   last_session_summary text,
   facts text,
+  context_fingerprint text,
+  facts_fingerprint text,
+  facts_source_stamp text,
   CONSTRAINT users_context_bundle_pkey PRIMARY KEY (user_id)
 );
 CREATE TABLE public.voice_emotion (
@@ -175,7 +178,9 @@ CREATE TABLE public.wb_embeddings (
   vector USER-DEFINED NOT NULL,
   model_tag text NOT NULL CHECK (model_tag = ANY (ARRAY['miniLM'::text, 'e5'::text])),
   created_at timestamp with time zone NOT NULL DEFAULT now(),
+  updated_at timestamp with time zone NOT NULL DEFAULT now(),
   CONSTRAINT wb_embeddings_pkey PRIMARY KEY (id),
+  CONSTRAINT wb_embeddings_ref_id_model_tag_key UNIQUE (ref_id, model_tag),
   CONSTRAINT wb_embeddings_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id)
 );
 CREATE TABLE public.wb_gratitude_item (
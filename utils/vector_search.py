@@ -5,14 +5,39 @@ This module provides semantic similarity search functionality using Supabase pgv
 Supports querying embeddings by semantic similarity and retrieving original message texts.
 """
 
+import heapq
 import logging
-from typing import List, Dict, Set
+import threading
+from collections import OrderedDict
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Iterable, Iterator, Optional, Set, Tuple
 from utils import database
-from utils.embeddings import generate_query_embedding
+from utils.embeddings import generate_query_embeddings_batch
+
+# Use xxhash for message dedup keys when available (64-bit ints instead of strings)
+try:
+    import xxhash
+    _dedupe_key = xxhash.xxh64_intdigest
+except ImportError:
+    xxhash = None
+    _dedupe_key = None
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
+# LRU cache of query embeddings keyed by (model_tag, query_text).
+# Query texts such as the extractors' focus areas are constants, so after the
+# first run their embeddings are served from memory instead of the model.
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+_query_embedding_cache: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+_query_embedding_cache_lock = threading.Lock()
+
+# PostgREST error code for "function not found"; once match_embeddings_multi is known
+# to be missing from the database, later searches go straight to the per-vector fallback
+_MISSING_FUNCTION_CODE = 'PGRST202'
+_multi_rpc_available = True
+
 
 def search_similar_embeddings(
     user_id: str,
@@ -95,6 +120,65 @@ def search_similar_embeddings(
         raise
 
 
+def get_query_embeddings(query_texts: List[str], model_tag: str = 'e5') -> List[List[float]]:
+    """
+    Get query embeddings, serving repeated texts from the in-memory LRU cache.
+    
+    Texts not in the cache are embedded together in one batch and then cached.
+    
+    Args:
+        query_texts: Query text strings to embed
+        model_tag: Model tag ('miniLM' or 'e5'), default 'e5'
+    
+    Returns:
+        List of embedding vectors, in the same order as query_texts
+    
+    Raises:
+        ValueError: If query_texts is empty or contains empty strings
+        Exception: If embedding generation fails
+    """
+    vectors: Dict[str, List[float]] = {}
+    with _query_embedding_cache_lock:
+        for text in query_texts:
+            key = (model_tag, text)
+            vector = _query_embedding_cache.get(key)
+            if vector is not None:
+                _query_embedding_cache.move_to_end(key)
+                vectors[text] = vector
+    
+    missing = [text for text in dict.fromkeys(query_texts) if text not in vectors]
+    if missing:
+        logger.debug(f"Generating {len(missing)} query embeddings ({len(query_texts) - len(missing)} cached)")
+        new_vectors = generate_query_embeddings_batch(missing, model_tag=model_tag)
+        with _query_embedding_cache_lock:
+            for text, vector in zip(missing, new_vectors):
+                vectors[text] = vector
+                _query_embedding_cache[(model_tag, text)] = vector
+            while len(_query_embedding_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                _query_embedding_cache.popitem(last=False)
+    
+    return [vectors[text] for text in query_texts]
+
+
+def warmup_queries(query_texts: List[str], model_tag: str = 'e5') -> None:
+    """
+    Pre-compute and cache embeddings for known query texts (e.g., focus areas).
+    
+    Args:
+        query_texts: Query text strings to embed
+        model_tag: Model tag ('miniLM' or 'e5'), default 'e5'
+    """
+    get_query_embeddings(query_texts, model_tag=model_tag)
+
+
+def clear_query_embedding_cache() -> None:
+    """
+    Drop all cached query embeddings (e.g., after changing the embedding model).
+    """
+    with _query_embedding_cache_lock:
+        _query_embedding_cache.clear()
+
+
 def query_embeddings_by_semantic_prompt(
     user_id: str,
     query_text: str,
@@ -125,8 +209,8 @@ def query_embeddings_by_semantic_prompt(
     
     logger.debug(f"Generating query embedding for: '{query_text}'")
     
-    # Generate query embedding (uses "query: " prefix for E5 model)
-    query_vector = generate_query_embedding(query_text, model_tag=model_tag)
+    # Generate query embedding (uses "query: " prefix for E5 model, cached per text)
+    query_vector = get_query_embeddings([query_text], model_tag=model_tag)[0]
     
     # Perform similarity search
     return search_similar_embeddings(
@@ -138,6 +222,225 @@ def query_embeddings_by_semantic_prompt(
     )
 
 
+def search_similar_embeddings_multi(
+    user_id: str,
+    query_vectors: List[List[float]],
+    model_tag: str,
+    similarity_threshold: float = 0.7,
+    kind: str = 'message',
+    index_limit: int = None,
+    columns: str = None
+) -> List[Dict]:
+    """
+    Perform cosine similarity search for several query vectors in one round-trip.
+    
+    Uses the match_embeddings_multi RPC (see utils/functions.sql), which runs
+    match_embeddings for every query vector and deduplicates by ref_id server-side.
+    If the RPC fails, falls back to one search_similar_embeddings call per query
+    vector and deduplicates locally; if the function is missing from the database,
+    the RPC is not attempted again in this process.
+    
+    Args:
+        user_id: UUID of the user
+        query_vectors: List of query embedding vectors
+        model_tag: Model tag ('miniLM' or 'e5')
+        similarity_threshold: Minimum similarity score (0.0-1.0), default 0.7
+        kind: Type of embedding ('message', 'journal', etc.), default 'message'
+        index_limit: Number of nearest neighbors to fetch from HNSW index per vector (None = use default)
+        columns: Comma-separated RPC result columns to fetch, e.g. "ref_id, similarity"
+                 (None = all); keys for columns not fetched are None
+    
+    Returns:
+        List of dicts (one per unique ref_id, highest similarity kept), each containing:
+        - ref_id: UUID reference ID
+        - similarity_score: Similarity score (0.0-1.0)
+        - kind: Embedding kind
+        - created_at: Timestamp
+    
+    Raises:
+        RuntimeError: If every fallback search fails
+    """
+    if not query_vectors:
+        return []
+    
+    client = database.get_supabase_client()
+    
+    rpc_params = {
+        'query_vectors': query_vectors,  # jsonb array of vectors, cast server-side
+        'match_user_id': user_id,
+        'match_model_tag': model_tag,
+        'match_kind': kind,
+        'match_threshold': similarity_threshold,
+        'index_limit': index_limit if index_limit is not None else 100
+    }
+    
+    global _multi_rpc_available
+    response = None
+    if _multi_rpc_available:
+        try:
+            request = client.rpc('match_embeddings_multi', rpc_params)
+            if columns:
+                # Only transfer the columns the caller uses
+                request = request.select(columns)
+            response = request.execute()
+        except Exception as e:
+            if getattr(e, 'code', None) == _MISSING_FUNCTION_CODE:
+                _multi_rpc_available = False
+                logger.warning("match_embeddings_multi is not installed (see utils/functions.sql), "
+                               "using per-vector searches from now on")
+            else:
+                logger.warning(f"match_embeddings_multi RPC failed, falling back to per-vector searches: {e}")
+    
+    if response is not None:
+        results = [
+            {
+                'ref_id': item.get('ref_id'),
+                'similarity_score': item.get('similarity'),
+                'kind': item.get('kind'),
+                'created_at': item.get('created_at')
+            }
+            for item in response.data or []
+        ]
+        logger.debug(
+            f"Found {len(results)} similar embeddings for user {user_id} across "
+            f"{len(query_vectors)} query vectors (threshold: {similarity_threshold}, kind: {kind})"
+        )
+        return results
+    
+    # Fallback: one RPC per query vector, issued concurrently over the shared
+    # connection pool (threads release the GIL while waiting on the network)
+    def search_one(query_vector: List[float]) -> List[Dict]:
+        return search_similar_embeddings(
+            user_id=user_id,
+            query_vector=query_vector,
+            model_tag=model_tag,
+            similarity_threshold=similarity_threshold,
+            kind=kind,
+            index_limit=index_limit
+        )
+    
+    max_workers = min(len(query_vectors), database.SUPABASE_POOL_SIZE)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(search_one, query_vector) for query_vector in query_vectors]
+        
+        # Keep the best score per ref_id; a failed search does not discard the others
+        best_by_ref: Dict[str, Dict] = {}
+        failures = 0
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                failures += 1
+                logger.warning(f"Similarity search failed for one query vector: {e}")
+                continue
+            for result in results:
+                ref_id = result.get('ref_id')
+                if not ref_id:
+                    continue
+                existing = best_by_ref.get(ref_id)
+                if existing is None or (result.get('similarity_score') or 0) > (existing.get('similarity_score') or 0):
+                    best_by_ref[ref_id] = result
+    
+    if failures == len(query_vectors):
+        raise RuntimeError(f"All {failures} similarity searches failed for user {user_id}")
+    
+    return list(best_by_ref.values())
+
+
+def query_embeddings_by_semantic_prompts(
+    user_id: str,
+    query_texts: List[str],
+    model_tag: str = 'e5',
+    similarity_threshold: float = 0.7,
+    kind: str = 'message',
+    columns: str = None
+) -> List[Dict]:
+    """
+    Embed several query texts in one batch and search for all of them in one round-trip.
+    
+    Args:
+        user_id: UUID of the user
+        query_texts: Semantic query texts (e.g., focus areas)
+        model_tag: Model tag ('miniLM' or 'e5'), default 'e5'
+        similarity_threshold: Minimum similarity score (0.0-1.0), default 0.7
+        kind: Type of embedding ('message', 'journal', etc.), default 'message'
+        columns: Comma-separated result columns to fetch (None = all),
+                 see search_similar_embeddings_multi
+    
+    Returns:
+        List of dicts with ref_id, similarity_score, kind, created_at
+        (deduplicated by ref_id)
+    
+    Raises:
+        ValueError: If query_texts is empty or contains empty strings
+        Exception: If embedding generation or search fails
+    """
+    if not query_texts:
+        raise ValueError("query_texts cannot be empty")
+    
+    # Generate uncached query embeddings in a single model call
+    query_vectors = get_query_embeddings(query_texts, model_tag=model_tag)
+    
+    return search_similar_embeddings_multi(
+        user_id=user_id,
+        query_vectors=query_vectors,
+        model_tag=model_tag,
+        similarity_threshold=similarity_threshold,
+        kind=kind,
+        columns=columns
+    )
+
+
+def _iter_message_rows(ref_ids: List[str]) -> Iterator[Dict]:
+    """
+    Fetch wb_message rows (id, text, created_at) for ref_ids in chronological order.
+    
+    ref_ids are split into fixed-size chunks of database.MESSAGE_FETCH_BATCH_SIZE so
+    every request has the same bounded IN-list; when more than one chunk is needed
+    the chunks are fetched concurrently over the shared connection pool and merged
+    by created_at (each chunk is already sorted server-side).
+    
+    Args:
+        ref_ids: List of message UUIDs (ref_ids from embeddings)
+    
+    Yields:
+        Message rows, oldest first
+    
+    Raises:
+        Exception: If database query fails
+    """
+    client = database.get_supabase_client()
+    batch_size = database.MESSAGE_FETCH_BATCH_SIZE
+    
+    def fetch_chunk(chunk_ids: List[str]) -> List[Dict]:
+        response = client.table("wb_message")\
+            .select("id, text, created_at")\
+            .in_("id", chunk_ids)\
+            .order("created_at", desc=False)\
+            .execute()
+        return response.data or []
+    
+    ref_ids = list(ref_ids)
+    chunks = [ref_ids[i:i + batch_size] for i in range(0, len(ref_ids), batch_size)]
+    
+    try:
+        if len(chunks) == 1:
+            chunk_results = [fetch_chunk(chunks[0])]
+        else:
+            max_workers = min(len(chunks), database.SUPABASE_POOL_SIZE)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                chunk_results = list(executor.map(fetch_chunk, chunks))
+    except Exception as e:
+        logger.error(f"Failed to retrieve message texts: {e}")
+        raise
+    
+    if len(chunk_results) == 1:
+        yield from chunk_results[0]
+    else:
+        # created_at is an ISO-8601 string in a single time zone, so it sorts lexicographically
+        yield from heapq.merge(*chunk_results, key=itemgetter("created_at"))
+
+
 def retrieve_message_texts(ref_ids: List[str]) -> Dict[str, str]:
     """
     Fetch original message texts from wb_message table using ref_ids.
@@ -146,7 +449,7 @@ def retrieve_message_texts(ref_ids: List[str]) -> Dict[str, str]:
         ref_ids: List of message UUIDs (ref_ids from embeddings)
     
     Returns:
-        Dict mapping ref_id -> message text
+        Dict mapping ref_id -> message text, in chronological order (oldest first)
         Only includes ref_ids that were found in the database
     
     Raises:
@@ -155,29 +458,190 @@ def retrieve_message_texts(ref_ids: List[str]) -> Dict[str, str]:
     if not ref_ids:
         return {}
     
+    # Build mapping dictionary
+    message_texts = {}
+    for msg in _iter_message_rows(ref_ids):
+        msg_id = msg.get("id")
+        msg_text = msg.get("text", "")
+        if msg_id and msg_text:
+            message_texts[str(msg_id)] = msg_text
+    
+    logger.debug(f"Retrieved {len(message_texts)} message texts from {len(ref_ids)} ref_ids")
+    return message_texts
+
+
+def iter_message_texts(ref_ids: List[str]) -> Iterator[str]:
+    """
+    Stream original message texts from wb_message table using ref_ids.
+    
+    Yields texts straight from the fetched rows instead of building a
+    ref_id -> text mapping first.
+    
+    Args:
+        ref_ids: List of message UUIDs (ref_ids from embeddings)
+    
+    Yields:
+        Message texts in chronological order (oldest first); empty texts are skipped
+    
+    Raises:
+        Exception: If database query fails
+    """
+    if not ref_ids:
+        return
+    
+    for msg in _iter_message_rows(ref_ids):
+        msg_text = msg.get("text")
+        if msg_text:
+            yield msg_text
+
+
+def dedupe_message_texts(texts: Iterable[str]) -> Iterator[str]:
+    """
+    Drop duplicate message texts, keeping the first occurrence of each.
+    
+    Texts are compared after collapsing whitespace and case-folding, so the same
+    sentence retrieved for several focus areas is only sent to the LLM once.
+    
+    Args:
+        texts: Message texts in prompt order
+    
+    Yields:
+        Message texts (original form) with duplicates removed, order preserved
+    """
+    seen = set()
+    for text in texts:
+        key = ' '.join(text.split()).casefold()
+        if _dedupe_key is not None:
+            key = _dedupe_key(key)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield text
+
+
+def retrieve_relevant_ref_ids(
+    user_id: str,
+    query_texts: List[str],
+    model_tag: str = 'e5',
+    similarity_threshold: float = 0.7,
+    fallback_threshold: float = 0.6,
+    min_primary_results: int = 1,
+    max_results: Optional[int] = None
+) -> List[str]:
+    """
+    Find the ids of the user's messages relevant to a set of semantic queries.
+    
+    Runs one batched semantic search for all query texts at fallback_threshold and
+    keeps the matches scoring at least similarity_threshold; only if there are fewer
+    than min_primary_results of those are the lower-scoring matches used as well.
+    With max_results, only that many of the most similar matches are returned.
+    
+    Args:
+        user_id: UUID of the user
+        query_texts: Semantic query texts (e.g., the extractors' focus areas)
+        model_tag: Model tag ('miniLM' or 'e5'), default 'e5'
+        similarity_threshold: Minimum similarity score, default 0.7
+        fallback_threshold: Lower threshold used when too few matches reach
+                            similarity_threshold, default 0.6
+        min_primary_results: Matches needed at similarity_threshold before the
+                             lower-threshold matches are dropped, default 1
+        max_results: Optional cap on the number of ref_ids returned; the best
+                     matches are kept (ties broken by ref_id, so the choice is stable)
+    
+    Returns:
+        List of unique message ref_ids
+    
+    Raises:
+        ValueError: If no relevant messages are found
+    """
+    # Perform one batched semantic query for all focus areas at the lower threshold
+    # (single embedding call + single search round-trip), then prefer the
+    # matches above the main threshold; this replaces a second fallback query
+    logger.info(f"Performing batched semantic query for {len(query_texts)} focus areas")
     try:
-        client = database.get_supabase_client()
-        
-        # Query wb_message table for all ref_ids
-        # Use 'in' filter to get multiple messages at once
-        response = client.table("wb_message")\
-            .select("id, text")\
-            .in_("id", ref_ids)\
-            .execute()
-        
-        # Build mapping dictionary
-        message_texts = {}
-        if response.data:
-            for msg in response.data:
-                msg_id = msg.get("id")
-                msg_text = msg.get("text", "")
-                if msg_id and msg_text:
-                    message_texts[str(msg_id)] = msg_text
-        
-        logger.debug(f"Retrieved {len(message_texts)} message texts from {len(ref_ids)} ref_ids")
-        return message_texts
-        
+        results = query_embeddings_by_semantic_prompts(
+            user_id=user_id,
+            query_texts=query_texts,
+            model_tag=model_tag,
+            similarity_threshold=min(similarity_threshold, fallback_threshold),
+            kind='message',
+            columns="ref_id, similarity"
+        )
     except Exception as e:
-        logger.error(f"Failed to retrieve message texts: {e}")
-        raise
+        logger.warning(f"Failed to query focus areas: {e}")
+        results = []
+    
+    # Best similarity per ref_id across all focus areas
+    best_similarity: Dict[str, float] = {}
+    for result in results:
+        similarity = result.get('similarity_score') or 0
+        if similarity > best_similarity.get(result['ref_id'], -1.0):
+            best_similarity[result['ref_id']] = similarity
+    
+    all_ref_ids: Set[str] = {
+        ref_id for ref_id, similarity in best_similarity.items()
+        if similarity >= similarity_threshold
+    }
+    logger.debug(f"Found {len(all_ref_ids)} unique ref_ids across focus areas")
+    
+    # If too few results above the main threshold, use the lower-threshold matches
+    if len(all_ref_ids) < min_primary_results and len(best_similarity) > len(all_ref_ids):
+        logger.warning(f"Only {len(all_ref_ids)} results found with threshold {similarity_threshold}, "
+                       f"using matches above lower threshold {fallback_threshold}")
+        all_ref_ids = set(best_similarity)
+    
+    if not all_ref_ids:
+        raise ValueError(f"No relevant messages found for user {user_id} with semantic search")
+    
+    # Keep only the best matches when capped (partial sort, deterministic order)
+    if max_results is not None and len(all_ref_ids) > max_results:
+        logger.info(f"Keeping the {max_results} best of {len(all_ref_ids)} unique message references")
+        return heapq.nsmallest(max_results, all_ref_ids, key=lambda ref_id: (-best_similarity[ref_id], ref_id))
+    
+    logger.info(f"Retrieved {len(all_ref_ids)} unique message references")
+    
+    return list(all_ref_ids)
+
 
+def retrieve_relevant_message_texts(
+    user_id: str,
+    query_texts: List[str],
+    model_tag: str = 'e5',
+    similarity_threshold: float = 0.7,
+    fallback_threshold: float = 0.6,
+    min_primary_results: int = 1
+) -> Dict[str, str]:
+    """
+    Retrieve the user's message texts relevant to a set of semantic queries.
+    
+    Args:
+        user_id: UUID of the user
+        query_texts: Semantic query texts (e.g., the extractors' focus areas)
+        model_tag: Model tag ('miniLM' or 'e5'), default 'e5'
+        similarity_threshold: Minimum similarity score, default 0.7
+        fallback_threshold: Lower threshold used when too few matches reach
+                            similarity_threshold, default 0.6
+        min_primary_results: Matches needed at similarity_threshold before the
+                             lower-threshold matches are dropped, default 1
+    
+    Returns:
+        Dict mapping ref_id -> message text, in chronological order (oldest first)
+    
+    Raises:
+        ValueError: If no relevant messages are found
+    """
+    ref_ids = retrieve_relevant_ref_ids(
+        user_id, query_texts, model_tag, similarity_threshold, fallback_threshold,
+        min_primary_results
+    )
+    
+    # Retrieve message texts from database
+    logger.info("Retrieving message texts from database")
+    message_texts = retrieve_message_texts(ref_ids)
+    
+    if not message_texts:
+        raise ValueError(f"Failed to retrieve message texts for user {user_id}")
+    
+    logger.info(f"Retrieved {len(message_texts)} message texts")
+    
+    return message_texts